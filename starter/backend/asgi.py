@@ -0,0 +1,535 @@
+'''
+ASGI variant of the trivia API
+
+the categories, questions, search and quiz routes and the error handlers
+of flaskr with the same JSON, for an ASGI server:
+
+    uvicorn asgi:app --workers 2
+
+with SQLAlchemy 1.4 or newer and asyncpg (PostgreSQL) or aiosqlite
+(SQLite) installed the queries go through the async engine, otherwise
+the synchronous engine runs them in a thread pool of the size of the
+connection pool, so the event loop is never blocked
+'''
+import asyncio
+import importlib
+import json
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from sqlalchemy import and_, create_engine, func, select, true
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import StaticPool
+from config import Config, engine_options
+from encoding import get_encoder
+from models import Question, Category, QUESTION_FIELDS, parse_fields, \
+    insert_question, delete_question_rows, find_duplicate, \
+    bump_bank_version
+from flaskr import QUESTIONS_PER_PAGE, validate_question
+from search import InvertedIndexSearchBackend, search_postgres
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    create_async_engine = None
+
+
+# async driver of each database, used when it is installed
+ASYNC_DRIVERS = {'postgresql': ('postgresql+asyncpg', 'asyncpg'),
+                 'sqlite': ('sqlite+aiosqlite', 'aiosqlite')}
+HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization,true'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE,OPTIONS,PATCH'),
+]
+ERROR_MESSAGES = {400: 'bad request', 404: 'resource not found',
+                  405: 'method not allowed', 409: 'question already exists',
+                  422: 'unprocessable', 500: 'Internal Server Error'}
+
+questions_table = Question.__table__
+categories_table = Category.__table__
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+'''
+ThreadedDatabase
+    runs functions of a synchronous connection in a thread pool
+'''
+class ThreadedDatabase:
+
+    def __init__(self, url, options, workers):
+        if make_url(url).database in (None, '', ':memory:'):
+            # one connection shared by the threads, like Flask-SQLAlchemy
+            options = dict(options, poolclass=StaticPool, connect_args={
+                'check_same_thread': False})
+        self.engine = create_engine(url, **options)
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix='asgi-db')
+
+    async def run(self, function):
+        '''
+        return function(connection), run in one transaction
+        '''
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._run, function)
+
+    def _run(self, function):
+        with self.engine.begin() as connection:
+            return function(connection)
+
+    async def dispose(self):
+        self.executor.shutdown(wait=False)
+        self.engine.dispose()
+
+
+'''
+AsyncDatabase
+    runs functions of a connection of the async engine (SQLAlchemy 1.4+)
+'''
+class AsyncDatabase:
+
+    def __init__(self, url, options):
+        self.engine = create_async_engine(url, **options)
+
+    async def run(self, function):
+        '''
+        return function(connection), run in one transaction
+        '''
+        async with self.engine.begin() as connection:
+            return await connection.run_sync(function)
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+
+'''
+create_database(config)
+    AsyncDatabase when the async engine and the async driver of the
+    database are installed, ThreadedDatabase otherwise
+'''
+def create_database(config):
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = engine_options(config)
+    backend = url.get_backend_name()
+    if backend.startswith('postgres'):
+        backend = 'postgresql'
+    driver = ASYNC_DRIVERS.get(backend)
+    if create_async_engine is not None and driver is not None:
+        try:
+            importlib.import_module(driver[1])
+        except ImportError:
+            driver = None
+        if driver is not None:
+            url = url.set(drivername=driver[0])
+            timeout = options.pop('connect_args', {}).get('options')
+            if timeout:
+                options['connect_args'] = {'server_settings': {
+                    'statement_timeout': timeout.split('=')[-1]}}
+            return AsyncDatabase(url, options)
+    workers = config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW'] \
+        if options else 5
+    return ThreadedDatabase(str(url), options, workers)
+
+
+def _format(fields, rows):
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _columns(fields):
+    return [questions_table.c[field] for field in fields]
+
+
+def _questions_by_ids(connection, question_ids, fields=QUESTION_FIELDS):
+    '''
+    return the questions of question_ids in their order, one query,
+        the ids not found are skipped
+    '''
+    if not question_ids:
+        return []
+    fields = tuple(fields)
+    # the id finds the rows again, it is dropped when not asked for
+    columns = fields if 'id' in fields else fields + ('id',)
+    rows = connection.execute(select(_columns(columns)).where(
+        questions_table.c.id.in_(question_ids)))
+    by_id = {question['id']: question for question in _format(columns, rows)}
+    return [{field: by_id[question_id][field] for field in fields}
+            for question_id in question_ids if question_id in by_id]
+
+
+def _categories(connection):
+    rows = connection.execute(select([
+        categories_table.c.id, categories_table.c.type]).order_by(
+            categories_table.c.id))
+    return {row.id: row.type for row in rows}
+
+
+def _paginate(connection, where, args, fields):
+    '''
+    return current questions, total questions, next cursor
+        page mode (page) with LIMIT/OFFSET, keyset mode (after) with
+        WHERE id > after, the next cursor is None on the last page
+    '''
+    total = connection.execute(select([func.count(
+        questions_table.c.id)]).where(where)).scalar()
+    query = select(_columns(fields)).where(where).order_by(
+        questions_table.c.id)
+    after = _int_arg(args, 'after', None)
+    if after is None:
+        page = _int_arg(args, 'page', 1)
+        rows = connection.execute(query.offset(
+            max(page - 1, 0) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE))
+        return _format(fields, rows), total, None
+    rows = connection.execute(query.where(
+        questions_table.c.id > after).limit(QUESTIONS_PER_PAGE + 1))
+    questions = _format(fields, rows)
+    next_cursor = None
+    if len(questions) > QUESTIONS_PER_PAGE:
+        questions = questions[:QUESTIONS_PER_PAGE]
+        next_cursor = questions[-1]['id']
+    return questions, total, next_cursor
+
+
+def _int_arg(args, name, default):
+    try:
+        return int(args[name][0])
+    except (KeyError, IndexError, ValueError):
+        return default
+
+
+def _fields(args):
+    try:
+        return parse_fields(args.get('fields', [None])[0]) or QUESTION_FIELDS
+    except ValueError:
+        raise HTTPError(400)
+
+
+'''
+TriviaApp
+    the ASGI application, see create_asgi_app
+'''
+class TriviaApp:
+
+    def __init__(self, config):
+        self.config = config
+        self.db = create_database(config)
+        self.encode = get_encoder(config['JSON_ENCODER'])
+        # the inverted index of the questions, None for the full-text
+        # search of PostgreSQL, see setup
+        self.search = None
+        self._ready = False
+        self._ready_lock = asyncio.Lock()
+        self.routes = [
+            (re.compile(r'/categor(?:ies|y)$'),
+             {'GET': self.get_categories}),
+            (re.compile(r'/questions?$'),
+             {'GET': self.get_questions, 'POST': self.create_question}),
+            (re.compile(r'/questions?/(\d+)$'),
+             {'DELETE': self.delete_question}),
+            (re.compile(r'/questions/search$'),
+             {'POST': self.search_questions}),
+            (re.compile(r'/categories/(\d+)/questions$'),
+             {'GET': self.get_questions_on_category}),
+            (re.compile(r'/quizzes$'), {'POST': self.play_quiz}),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        status, payload = await self.handle(
+            scope['method'], scope['path'],
+            parse_qs(scope.get('query_string', b'').decode('latin-1')), body)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': HEADERS})
+        await send({'type': 'http.response.body',
+                    'body': self.encode(payload)})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.setup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.db.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def setup(self):
+        '''
+        create the tables once, like setup_db, and pick the search
+        backend like create_search_backend: the full-text search of
+        PostgreSQL or an inverted index loaded here
+        '''
+        async with self._ready_lock:
+            if not self._ready:
+                await self.db.run(Question.metadata.create_all)
+                name = self.config['SEARCH_BACKEND'] or (
+                    'postgres' if self.db.engine.dialect.name ==
+                    'postgresql' else 'inverted')
+                if name == 'inverted':
+                    search = InvertedIndexSearchBackend(source=None)
+                    await self.db.run(lambda connection: search.load(
+                        connection.execute(select([
+                            questions_table.c.id,
+                            questions_table.c.question]))))
+                    self.search = search
+                elif name != 'postgres':
+                    raise ValueError(
+                        'unknown search backend {!r}'.format(name))
+                self._ready = True
+
+    async def handle(self, method, path, args, body):
+        '''
+        return status and JSON payload of the request
+        '''
+        try:
+            if not self._ready:
+                await self.setup()
+            for pattern, methods in self.routes:
+                match = pattern.match(path)
+                if match is None:
+                    continue
+                if method not in methods:
+                    raise HTTPError(405)
+                data = None
+                if body:
+                    try:
+                        data = json.loads(body)
+                    except ValueError:
+                        raise HTTPError(400)
+                return 200, await methods[method](args, data, *[
+                    int(group) for group in match.groups()])
+            raise HTTPError(404)
+        except HTTPError as error:
+            status = error.status
+        except Exception:
+            status = 500
+        return status, {'success': False, 'error': status,
+                        'message': ERROR_MESSAGES[status]}
+
+    async def get_categories(self, args, data):
+        return {'success': True,
+                'categories': await self.db.run(_categories)}
+
+    async def get_questions(self, args, data):
+        fields = _fields(args)
+
+        def query(connection):
+            return _paginate(connection, true(), args, fields) + (
+                _categories(connection),)
+        questions, total, next_cursor, categories = await self.db.run(query)
+        if not questions:
+            raise HTTPError(404)
+        result = {'success': True, 'questions': questions,
+                  'totalQuestions': total, 'categories': categories}
+        if 'after' in args:
+            result['next_cursor'] = next_cursor
+        return result
+
+    async def get_questions_on_category(self, args, data, category_id):
+        fields = _fields(args)
+
+        def query(connection):
+            categories = _categories(connection)
+            if category_id not in categories:
+                raise HTTPError(404)
+            return _paginate(connection, questions_table.c.category ==
+                             category_id, args, fields) + (
+                                 categories[category_id],)
+        questions, total, next_cursor, category = await self.db.run(query)
+        result = {'success': True, 'questions': questions,
+                  'totalQuestions': total, 'categories': category}
+        if 'after' in args:
+            result['next_cursor'] = next_cursor
+        return result
+
+    async def create_question(self, args, data):
+        try:
+            values = validate_question(data or {},
+                                       await self.db.run(_categories))
+        except ValueError:
+            raise HTTPError(422)
+        duplicate = await self.db.run(
+            lambda connection: find_duplicate(connection, values))
+        if duplicate is not None:
+            raise HTTPError(409)
+        try:
+            question = await self.db.run(
+                lambda connection: insert_question(connection, values))
+        except Exception:
+            duplicate = await self.db.run(
+                lambda connection: find_duplicate(connection, values))
+            if duplicate is not None:
+                raise HTTPError(409)
+            raise HTTPError(422)
+        await self.db.run(bump_bank_version)
+        self._notify('insert', [question])
+        return dict(values, success=True)
+
+    async def delete_question(self, args, data, question_id):
+        try:
+            deleted = await self.db.run(lambda connection:
+                                        delete_question_rows(connection,
+                                                             [question_id]))
+        except Exception:
+            raise HTTPError(422)
+        if not deleted:
+            raise HTTPError(422)
+        await self.db.run(bump_bank_version)
+        self._notify('delete', deleted)
+        return {'success': True, 'message': 'Question successfully deleted',
+                'delete_id': question_id}
+
+    def _notify(self, action, questions):
+        '''
+        keep the inverted search index up to date with the writes of
+        this process
+        '''
+        if self.search is not None:
+            for question in questions:
+                self.search.on_question_change(action, question)
+
+    async def search_questions(self, args, data):
+        term = (data or {}).get('searchTerm', '')
+        if term == '':
+            raise HTTPError(422)
+        fields = _fields(args)
+        offset = max(_int_arg(args, 'page', 1) - 1, 0) * QUESTIONS_PER_PAGE
+
+        def query(connection):
+            if self.search is None:
+                question_ids, total = search_postgres(
+                    connection, term, offset, QUESTIONS_PER_PAGE)
+            else:
+                question_ids, total = self.search.search(
+                    term, offset, QUESTIONS_PER_PAGE)
+            return _questions_by_ids(connection, question_ids, fields), total
+        try:
+            questions, total = await self.db.run(query)
+        except Exception:
+            raise HTTPError(404)
+        if not questions:
+            raise HTTPError(404)
+        return {'success': True, 'questions': questions,
+                'totalQuestions': total,
+                'current_category': questions[-1].get('category')}
+
+    async def play_quiz(self, args, data):
+        data = data or {}
+        previous_questions = data.get('previous_questions', '')
+        quiz_category = data.get('quiz_category', '')
+        if quiz_category is None or previous_questions is None or \
+                not isinstance(previous_questions or [], list):
+            raise HTTPError(400)
+        try:
+            count = int(data.get('count', 1))
+            category_id = int(quiz_category['id'])
+            previous_questions = [int(question_id) for question_id
+                                  in previous_questions or ()]
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400)
+        if not 1 <= count <= self.config['QUIZ_MAX_COUNT']:
+            raise HTTPError(400)
+
+        def query(connection):
+            # one COUNT of the candidates, then the ids at the random
+            # positions in one scan of the (category, id) index
+            where = true()
+            if category_id != 0:
+                where = questions_table.c.category == category_id
+            if previous_questions:
+                where = and_(where, questions_table.c.id.notin_(
+                    previous_questions))
+            remaining = connection.execute(select([func.count(
+                questions_table.c.id)]).where(where)).scalar()
+            positions = random.sample(range(1, remaining + 1),
+                                      min(count, remaining))
+            if not positions:
+                return [], remaining
+            candidates = select([
+                questions_table.c.id,
+                func.row_number().over(
+                    order_by=questions_table.c.id).label('position')
+            ]).where(where).alias('candidates')
+            picked = dict(connection.execute(select([
+                candidates.c.position, candidates.c.id]).where(
+                    candidates.c.position.in_(positions))).fetchall())
+            questions = _questions_by_ids(connection, [
+                picked[position] for position in positions
+                if position in picked])
+            return questions, remaining
+        questions, remaining = await self.db.run(query)
+        return {'success': True,
+                'question': questions[0] if questions else None,
+                'questions': questions,
+                'exhausted': remaining <= count}
+
+
+'''
+create_asgi_app(config=None)
+    create the ASGI application
+    config: object or dict of settings that replace the defaults
+        of config.Config, like create_app
+    return TriviaApp
+'''
+def create_asgi_app(config=None):
+    settings = vars(Config())
+    if isinstance(config, dict):
+        settings.update(config)
+    elif config is not None:
+        settings.update({key: getattr(config, key) for key in dir(config)
+                         if key.isupper()})
+    return TriviaApp(settings)
+
+
+'''
+asgi_request(app, method, path, json_body=None)
+    calls the ASGI app in the same process, for the tests and benchmarks
+return status and decoded JSON body
+'''
+async def asgi_request(app, method, path, json_body=None):
+    path, _, query_string = path.partition('?')
+    body = json.dumps(json_body).encode('utf-8') \
+        if json_body is not None else b''
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+    await app({'type': 'http', 'method': method, 'path': path,
+               'query_string': query_string.encode('latin-1'),
+               'headers': [(b'content-type', b'application/json')]},
+              receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+_app = None
+
+
+'''
+app
+    application for the ASGI servers (uvicorn asgi:app), created with
+    the environment configuration on the first request
+'''
+async def app(scope, receive, send):
+    global _app
+    if _app is None:
+        _app = create_asgi_app()
+    await _app(scope, receive, send)
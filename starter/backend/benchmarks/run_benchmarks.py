@@ -0,0 +1,384 @@
+'''
+Load benchmarks of the trivia API
+
+seeds a synthetic question bank of every --sizes into SQLite (default)
+or a scratch PostgreSQL database, then drives each route through the
+Flask test client, through a real threaded WSGI server and through the
+ASGI variant (asgi.py, called in process by concurrent tasks) and reports
+throughput and p50/p95/p99 latency as JSON.
+
+    python benchmarks/run_benchmarks.py --sizes 1000 100000 -o results.json
+    python benchmarks/run_benchmarks.py --sizes 1000 --baseline results.json
+
+with --baseline the results are compared to a previous run and the
+exit code is 1 when a route got slower than --tolerance allows.
+'''
+import argparse
+import asyncio
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import sqlalchemy  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+from flaskr import create_app  # noqa: E402
+from asgi import create_asgi_app, asgi_request  # noqa: E402
+from models import db, Question, Category  # noqa: E402
+
+
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports')
+VOCABULARY_SIZE = 5000
+SEED_CHUNK_SIZE = 10000
+DRIVERS = ('test_client', 'wsgi', 'asgi')
+# scenarios that change the bank, every error of them is counted
+WRITE_SCENARIOS = ('POST /questions', 'DELETE /questions/<id>')
+
+
+def vocabulary():
+    rng = random.Random(0)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add(''.join(rng.choice(letters)
+                          for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+'''
+seed(app, size)
+    recreates the tables and inserts the categories and size questions
+    of words taken from the vocabulary (the same bank for the same size)
+'''
+def seed(app, size, words):
+    rng = random.Random(size)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(Category.__table__.insert(),
+                           [{'id': i + 1, 'type': category}
+                            for i, category in enumerate(CATEGORIES)])
+        rows = []
+        for i in range(size):
+            rows.append({
+                'question': ' '.join(rng.choice(words) for _ in range(
+                    rng.randint(6, 14))).capitalize() + '?',
+                'answer': ' '.join(rng.choice(words)
+                                   for _ in range(rng.randint(1, 3))),
+                'difficulty': rng.randint(1, 5),
+                'category': rng.randint(1, len(CATEGORIES)),
+            })
+            if len(rows) >= SEED_CHUNK_SIZE:
+                db.session.execute(Question.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(Question.__table__.insert(), rows)
+        db.session.commit()
+        return db.session.query(sqlalchemy.func.max(Question.id)).scalar()
+
+
+'''
+scenarios(size, max_id, words)
+    name -> function(rng) returning (method, path, json body)
+'''
+def scenarios(size, max_id, words):
+    pages = max(size // 10, 1)
+    deleted = iter(range(max_id, 0, -1))
+
+    def new_question(rng):
+        return {'question': ' '.join(rng.choice(words) for _ in range(8)),
+                'answer': rng.choice(words),
+                'difficulty': rng.randint(1, 5),
+                'category': rng.randint(1, len(CATEGORIES))}
+
+    return {
+        'GET /categories': lambda rng: ('GET', '/categories', None),
+        'GET /questions?page': lambda rng: (
+            'GET', '/questions?page={}'.format(rng.randint(1, pages)), None),
+        'GET /questions?after': lambda rng: (
+            'GET', '/questions?after={}'.format(rng.randint(0, max_id - 10)),
+            None),
+        'POST /questions/search': lambda rng: (
+            'POST', '/questions/search',
+            {'searchTerm': rng.choice(words)}),
+        'GET /categories/<id>/questions': lambda rng: (
+            'GET', '/categories/{}/questions?page={}'.format(
+                rng.randint(1, len(CATEGORIES)),
+                rng.randint(1, max(pages // len(CATEGORIES), 1))), None),
+        'POST /quizzes': lambda rng: (
+            'POST', '/quizzes',
+            {'previous_questions': rng.sample(range(1, max_id + 1),
+                                              min(5, max_id)),
+             'quiz_category': {'id': rng.randint(0, len(CATEGORIES))}}),
+        'POST /questions': lambda rng: (
+            'POST', '/questions', new_question(rng)),
+        'DELETE /questions/<id>': lambda rng: (
+            'DELETE', '/questions/{}'.format(next(deleted)), None),
+    }
+
+
+def percentile(latencies, fraction):
+    index = min(int(round(fraction * (len(latencies) - 1))),
+                len(latencies) - 1)
+    return latencies[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+'''
+failed(status, writes)
+    a server error, or any error of a write scenario: a rejected write
+    (e.g. 409 for a duplicate question) is not the work measured
+'''
+def failed(status, writes):
+    return status >= 500 or (writes and status >= 400)
+
+
+'''
+run_test_client(app, scenario, requests, warmup, seed, writes)
+    sequential requests through the Flask test client, the requests
+    come from scenario with a random generator of seed
+'''
+def run_test_client(app, scenario, requests, warmup, seed=1, writes=False):
+    client = app.test_client()
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        method, path, body = scenario(rng)
+        client.open(path, method=method, json=body)
+    latencies, errors = [], 0
+    begin = time.perf_counter()
+    for _ in range(requests):
+        method, path, body = scenario(rng)
+        start = time.perf_counter()
+        res = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - start)
+        errors += failed(res.status_code, writes)
+    return summarize(latencies, errors, time.perf_counter() - begin)
+
+
+'''
+run_wsgi(port, scenario, requests, warmup, concurrency, seed, writes)
+    concurrent HTTP requests to the threaded WSGI server on port
+'''
+def run_wsgi(port, scenario, requests, warmup, concurrency, seed=1,
+             writes=False):
+    lock = threading.Lock()
+    rng = random.Random(seed)
+
+    def call():
+        with lock:
+            method, path, body = scenario(rng)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        start = time.perf_counter()
+        connection.request(method, path, payload, headers)
+        res = connection.getresponse()
+        res.read()
+        latency = time.perf_counter() - start
+        connection.close()
+        return latency, res.status
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda _: call(), range(warmup)))
+        begin = time.perf_counter()
+        results = list(pool.map(lambda _: call(), range(requests)))
+        elapsed = time.perf_counter() - begin
+    return summarize([latency for latency, _ in results],
+                     sum(failed(status, writes) for _, status in results),
+                     elapsed)
+
+
+'''
+run_asgi(app, scenario, requests, warmup, concurrency, seed, writes)
+    requests of concurrency tasks to the ASGI app on one event loop
+'''
+def run_asgi(app, scenario, requests, warmup, concurrency, seed=1,
+             writes=False):
+    rng = random.Random(seed)
+
+    async def call():
+        method, path, body = scenario(rng)
+        start = time.perf_counter()
+        status, _ = await asgi_request(app, method, path, body)
+        return time.perf_counter() - start, status
+
+    async def calls(count):
+        pending = iter(range(count))
+        results = []
+
+        async def worker():
+            for _ in pending:
+                results.append(await call())
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results
+
+    async def main():
+        await calls(warmup)
+        begin = time.perf_counter()
+        results = await calls(requests)
+        return results, time.perf_counter() - begin
+
+    results, elapsed = asyncio.run(main())
+    return summarize([latency for latency, _ in results],
+                     sum(failed(status, writes) for _, status in results),
+                     elapsed)
+
+
+'''
+compare(results, baseline, tolerance)
+    regressions of results against baseline: a p95 latency higher or a
+    throughput lower than the baseline by more than tolerance
+'''
+def compare(results, baseline, tolerance):
+    regressions = []
+    for size, drivers in results.items():
+        for driver, routes in drivers.items():
+            for route, stats in routes.items():
+                base = baseline.get(size, {}).get(driver, {}).get(route)
+                if base is None:
+                    continue
+                where = '{} questions, {}, {}'.format(size, driver, route)
+                if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                    regressions.append('{}: p95 {} ms -> {} ms'.format(
+                        where, base['p95_ms'], stats['p95_ms']))
+                if stats['throughput'] < base['throughput'] * (1 - tolerance):
+                    regressions.append('{}: throughput {} -> {} req/s'.format(
+                        where, base['throughput'], stats['throughput']))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000],
+                        help='question bank sizes, e.g. 1000 100000 1000000')
+    parser.add_argument('--database-url',
+                        help='scratch PostgreSQL database, its tables are '
+                             'dropped (default: a SQLite file per size)')
+    parser.add_argument('--workdir', default=tempfile.gettempdir(),
+                        help='directory of the SQLite files')
+    parser.add_argument('--drivers', nargs='+', choices=DRIVERS,
+                        default=list(DRIVERS))
+    parser.add_argument('--routes', nargs='+',
+                        help='only the routes with these names')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='client threads of the wsgi driver, tasks '
+                             'of the asgi driver')
+    parser.add_argument('-o', '--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    words = vocabulary()
+    results = {}
+    for size in args.sizes:
+        url = args.database_url or 'sqlite:///{}'.format(os.path.join(
+            os.path.abspath(args.workdir), 'trivia_bench_{}.db'.format(size)))
+        app = create_app({'SQLALCHEMY_DATABASE_URI': url,
+                          'DB_POOL_SIZE': args.concurrency})
+        print('seeding {} questions into {}'.format(size, url),
+              file=sys.stderr)
+        max_id = seed(app, size, words)
+        results[str(size)] = {}
+        server = None
+        if 'wsgi' in args.drivers:
+            # no access log line per request
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        asgi_app = None
+        if 'asgi' in args.drivers:
+            asgi_app = create_asgi_app({'SQLALCHEMY_DATABASE_URI': url,
+                                        'DB_POOL_SIZE': args.concurrency})
+        try:
+            for driver in args.drivers:
+                # the write routes run last so the reads see the seeded bank
+                routes = scenarios(size, max_id, words)
+                report = results[str(size)].setdefault(driver, {})
+                for name, scenario in routes.items():
+                    if args.routes and name not in args.routes:
+                        continue
+                    print('{} questions, {}, {}'.format(size, driver, name),
+                          file=sys.stderr)
+                    # each driver posts other questions than the others,
+                    # not duplicates of theirs
+                    rng_seed = DRIVERS.index(driver) + 1
+                    writes = name in WRITE_SCENARIOS
+                    if driver == 'test_client':
+                        report[name] = run_test_client(
+                            app, scenario, args.requests, args.warmup,
+                            rng_seed, writes)
+                    elif driver == 'asgi':
+                        report[name] = run_asgi(
+                            asgi_app, scenario, args.requests, args.warmup,
+                            args.concurrency, rng_seed, writes)
+                    else:
+                        report[name] = run_wsgi(
+                            server.server_port, scenario, args.requests,
+                            args.warmup, args.concurrency, rng_seed,
+                            writes)
+                max_id -= args.requests + args.warmup
+        finally:
+            if server is not None:
+                server.shutdown()
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'database': 'postgres' if args.database_url else 'sqlite',
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+from models import db, Question
+
+
+EXPORT_FIELDS = ('id', 'question', 'answer', 'difficulty', 'category')
+# rows fetched from the server-side cursor and sent at once
+EXPORT_CHUNK_SIZE = 1000
+
+
+'''
+export_rows(category)
+    tuples of EXPORT_FIELDS ordered by id, read from a server-side
+    cursor EXPORT_CHUNK_SIZE rows at a time (all rows when category is None)
+'''
+def export_rows(category=None):
+    rows = db.session.query(
+        *[getattr(Question, field) for field in EXPORT_FIELDS])
+    if category is not None:
+        rows = rows.filter(Question.category == category)
+    return rows.order_by(Question.id).execution_options(
+        stream_results=True).yield_per(EXPORT_CHUNK_SIZE)
+
+
+'''
+ndjson_lines(rows)
+    yields the rows as NDJSON, EXPORT_CHUNK_SIZE lines at a time
+'''
+def ndjson_lines(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_FIELDS, row))))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+'''
+csv_lines(rows)
+    yields the rows as CSV with a header line,
+    EXPORT_CHUNK_SIZE lines at a time
+'''
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
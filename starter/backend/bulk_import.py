@@ -0,0 +1,111 @@
+import csv
+import json
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Question, QUESTION_FIELDS, bump_bank_version, \
+    content_hash, notify_question_change
+
+
+MAX_REPORTED_ERRORS = 100
+
+
+'''
+read_ndjson(stream)
+    yields (line number, parsed object) for every non empty line,
+    the object is None when the line is not valid JSON
+'''
+def read_ndjson(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+'''
+read_csv(stream)
+    yields (line number, row dict) of a CSV with a header line
+'''
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+'''
+import_questions(rows, validate, batch_size)
+    inserts the rows that pass validate(row) in batches of batch_size,
+    one multi-row INSERT and one transaction per batch, so only one batch
+    is held in memory. validate returns the column values of the question
+    or raises ValueError with the reason. rows with the content hash of
+    a question of the bank or of an earlier row are skipped as duplicates.
+return the number of inserted, failed and duplicate rows and the errors
+    (the first MAX_REPORTED_ERRORS of them) as {'line', 'message'}
+'''
+def import_questions(rows, validate, batch_size):
+    result = {'inserted': 0, 'failed': 0, 'duplicates': 0, 'errors': []}
+    batch = []
+    for line_number, row in rows:
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('not a valid question object')
+            batch.append((line_number, validate(row)))
+        except ValueError as error:
+            _add_error(result, line_number, str(error))
+        if len(batch) >= batch_size:
+            _insert_batch(batch, result)
+            batch = []
+    if batch:
+        _insert_batch(batch, result)
+    return result
+
+
+def _insert_batch(batch, result):
+    hashes = [content_hash(values['question'], values['answer'])
+              for _, values in batch]
+    rows = []
+    # hashes of the rows of this batch, the rows of the earlier batches
+    # are committed and found by the query
+    imported = set()
+    try:
+        existing = {row[0] for row in db.session.query(
+            Question.content_hash).filter(Question.content_hash.in_(hashes))}
+        for (line_number, values), value_hash in zip(batch, hashes):
+            if value_hash in existing or value_hash in imported:
+                _add_error(result, line_number, 'duplicate question',
+                           'duplicates')
+            else:
+                imported.add(value_hash)
+                rows.append((line_number,
+                             dict(values, content_hash=value_hash)))
+        if not rows:
+            return
+        db.session.execute(Question.__table__.insert(),
+                           [values for _, values in rows])
+        # the multi-row INSERT does not return the ids, the unique
+        # content hashes of the rows find them
+        ids = dict(db.session.query(
+            Question.content_hash, Question.id).filter(
+                Question.content_hash.in_([values['content_hash']
+                                           for _, values in rows])))
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        for line_number, _ in rows or batch:
+            _add_error(result, line_number, 'could not insert the batch')
+        return
+    # after the commit, see bump_bank_version
+    bump_bank_version(db.session)
+    db.session.commit()
+    result['inserted'] += len(rows)
+    for _, values in rows:
+        question = {field: values.get(field) for field in QUESTION_FIELDS}
+        question['id'] = ids[values['content_hash']]
+        notify_question_change('insert', question)
+
+
+def _add_error(result, line_number, message, count='failed'):
+    result[count] += 1
+    if len(result['errors']) < MAX_REPORTED_ERRORS:
+        result['errors'].append({'line': line_number, 'message': message})
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import db, Category, database_source
+
+
+CategoryEntry = namedtuple('CategoryEntry', ['version', 'categories', 'etag'])
+
+
+'''
+CategoryCache
+    process-local copy of the categories table {id: type}.
+    every invalidate() bumps the version and the next get() reloads,
+    the etag is a hash of the content so it is the same on every worker.
+    ttl bounds how long a change made by another process stays unseen.
+    the categories are read from source (the database by default)
+'''
+class CategoryCache:
+
+    def __init__(self, ttl=60, source=database_source):
+        self.ttl = ttl
+        self.source = source
+        self._version = 0
+        self._entry = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._entry = None
+
+    def on_question_change(self, action, question=None):
+        '''
+        question listener, a 'reload' may have changed the categories too
+        '''
+        if action == 'reload':
+            self.invalidate()
+
+    def get(self):
+        '''
+        return CategoryEntry(version, categories, etag)
+        '''
+        entry = self._entry
+        if entry is not None and (
+                time.monotonic() - self._loaded_at < self.ttl):
+            return entry
+        with self._lock:
+            version = self._version
+            categories = self.source.categories()
+            etag = hashlib.sha1(json.dumps(
+                sorted(categories.items())).encode('utf-8')).hexdigest()
+            if self._entry is None or self._entry.etag != etag:
+                if self._entry is not None:
+                    # changed by another process
+                    self._version += 1
+                    version = self._version
+                self._entry = CategoryEntry(version, categories, etag)
+            self._loaded_at = time.monotonic()
+            return self._entry
+
+
+'''
+categories changes are marked on the session when they are flushed
+and the cache is invalidated once the session commits them
+'''
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _mark_categories_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['categories_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_categories(session):
+    if session.info.pop('categories_changed', False):
+        cache = db.get_app().extensions.get('categories')
+        if cache is not None:
+            cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_categories_changed(session):
+    session.info.pop('categories_changed', None)
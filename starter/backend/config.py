@@ -0,0 +1,149 @@
+import os
+from sqlalchemy.engine.url import make_url
+
+
+database_name = "trivia"
+database_username = 'postgres'
+database_password = '1'
+database_host = 'localhost:5432'
+database_path = "postgres://{}:{}@{}/{}".format(database_username, database_password, database_host, database_name)
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if cast is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+def _list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+'''
+Config
+    default configuration of create_app,
+    every setting can be set by an environment variable of the same name
+    (DATABASE_URL for SQLALCHEMY_DATABASE_URI)
+'''
+class Config:
+
+    def __init__(self):
+        # postgres://..., sqlite:///path/to/file.db or sqlite:// (memory)
+        self.SQLALCHEMY_DATABASE_URI = _env('DATABASE_URL', database_path)
+        # serve the reads from an in-memory snapshot and reject the
+        # writes, see snapshot.py
+        self.SNAPSHOT_MODE = _env('SNAPSHOT_MODE', False, bool)
+        # comma separated read replica URLs, see routing.py
+        self.DATABASE_REPLICA_URLS = _env('DATABASE_REPLICA_URLS', [], _list)
+        # seconds the reads of a client go to the primary after it wrote
+        self.DB_READ_YOUR_WRITES_SECONDS = _env('DB_READ_YOUR_WRITES_SECONDS',
+                                                5, int)
+        # connection pool, not used by SQLite
+        self.DB_POOL_SIZE = _env('DB_POOL_SIZE', 5, int)
+        self.DB_MAX_OVERFLOW = _env('DB_MAX_OVERFLOW', 10, int)
+        self.DB_POOL_TIMEOUT = _env('DB_POOL_TIMEOUT', 30, int)
+        self.DB_POOL_PRE_PING = _env('DB_POOL_PRE_PING', False, bool)
+        # seconds before a connection is replaced, -1 never
+        self.DB_POOL_RECYCLE = _env('DB_POOL_RECYCLE', -1, int)
+        # PostgreSQL statement_timeout, None for no timeout
+        self.DB_STATEMENT_TIMEOUT_MS = _env('DB_STATEMENT_TIMEOUT_MS',
+                                            None, int)
+        self.QUIZ_SESSION_TTL = _env('QUIZ_SESSION_TTL', 60 * 60, int)
+        # quiz sessions kept by each server process, the least recently
+        # used one is dropped for a new one past it
+        self.QUIZ_MAX_SESSIONS = _env('QUIZ_MAX_SESSIONS', 1000, int)
+        # questions POST /quizzes returns at most in one response
+        self.QUIZ_MAX_COUNT = _env('QUIZ_MAX_COUNT', 50, int)
+        # 'postgres', 'inverted' or None to pick by the database
+        self.SEARCH_BACKEND = _env('SEARCH_BACKEND', None)
+        # words kept by the typeahead index of GET /questions/suggest
+        self.SUGGEST_MAX_TOKENS = _env('SUGGEST_MAX_TOKENS', 100000, int)
+        # seconds before the typeahead index and the inverted search
+        # index check the bank version for changes of other processes
+        self.SEARCH_INDEX_TTL = _env('SEARCH_INDEX_TTL', 30, float)
+        # seconds before the category cache checks for changes
+        # of other processes
+        self.CATEGORY_CACHE_TTL = _env('CATEGORY_CACHE_TTL', 60, int)
+        # seconds the bank version of the ETags is kept before it is read
+        # again, bounds how long a change of another process gets a 304
+        self.BANK_VERSION_TTL = _env('BANK_VERSION_TTL', 1, float)
+        # Cache-Control max-age of the GET responses, 0 to always revalidate
+        self.CATEGORIES_CACHE_MAX_AGE = _env('CATEGORIES_CACHE_MAX_AGE', 0,
+                                             int)
+        self.QUESTIONS_CACHE_MAX_AGE = _env('QUESTIONS_CACHE_MAX_AGE', 0,
+                                            int)
+        # question ids kept by the per-category id index
+        self.QUESTION_INDEX_MAX_IDS = _env('QUESTION_INDEX_MAX_IDS', 1000000,
+                                           int)
+        # seconds before the id index checks a category for changes
+        # of other processes
+        self.QUESTION_INDEX_TTL = _env('QUESTION_INDEX_TTL', 5, float)
+        # questions kept encoded as JSON by the fragment cache, 0 for none
+        self.QUESTION_FRAGMENT_CACHE_SIZE = _env(
+            'QUESTION_FRAGMENT_CACHE_SIZE', 10000, int)
+        # seconds a question stays in the fragment cache, bounds how long
+        # a change of another process is served
+        self.QUESTION_FRAGMENT_CACHE_TTL = _env(
+            'QUESTION_FRAGMENT_CACHE_TTL', 5, float)
+        # group commit of the question writes: milliseconds the writes
+        # are gathered for one transaction, None to commit each write
+        self.GROUP_COMMIT_WINDOW_MS = _env('GROUP_COMMIT_WINDOW_MS', None,
+                                           float)
+        self.GROUP_COMMIT_MAX_BATCH = _env('GROUP_COMMIT_MAX_BATCH', 100, int)
+        # ids DELETE /questions takes at once
+        self.BULK_DELETE_MAX_IDS = _env('BULK_DELETE_MAX_IDS', 1000, int)
+        # token bucket "rate/burst" of each client over all routes,
+        # e.g. "20/40", None for no limit
+        self.RATE_LIMIT_PER_CLIENT = _env('RATE_LIMIT_PER_CLIENT', None)
+        # "endpoint=rate/burst,..." buckets of each client by route,
+        # e.g. "searchQuestion=2/5,quizPlay=5/10"
+        self.RATE_LIMIT_ROUTES = _env('RATE_LIMIT_ROUTES', None)
+        # 'memory' (per worker) or 'sqlite:///path' (shared by the workers)
+        self.RATE_LIMIT_STORE = _env('RATE_LIMIT_STORE', 'memory')
+        # header of the client address behind a proxy, e.g. X-Forwarded-For
+        self.RATE_LIMIT_CLIENT_HEADER = _env('RATE_LIMIT_CLIENT_HEADER', None)
+        # proxies in front of the app that append to that header,
+        # the client is the address added by the farthest of them
+        self.RATE_LIMIT_TRUSTED_HOPS = _env('RATE_LIMIT_TRUSTED_HOPS', 1, int)
+        # requests in progress at most, the others get 503, None for no cap
+        self.MAX_CONCURRENT_REQUESTS = _env('MAX_CONCURRENT_REQUESTS', None,
+                                            int)
+        # rows inserted in one transaction by POST /questions/bulk
+        self.BULK_IMPORT_BATCH_SIZE = _env('BULK_IMPORT_BATCH_SIZE', 1000,
+                                           int)
+        # requests slower than this are sampled and their stacks logged,
+        # None to turn the sampling profiler off
+        self.PROFILE_SLOW_REQUEST_MS = _env('PROFILE_SLOW_REQUEST_MS', None,
+                                            int)
+        # 'orjson', 'json' or None for orjson when it is installed
+        self.JSON_ENCODER = _env('JSON_ENCODER', None)
+        # responses smaller than this are not compressed
+        self.COMPRESS_MIN_SIZE = _env('COMPRESS_MIN_SIZE', 500, int)
+        self.COMPRESS_LEVEL = _env('COMPRESS_LEVEL', 6, int)
+
+
+'''
+engine_options(config)
+    create_engine options of the database in config: pool sizes,
+    pre-ping, recycle and statement timeout for server databases.
+    SQLite uses no pool for files and one shared connection in memory
+'''
+def engine_options(config):
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.drivername.startswith('sqlite'):
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    timeout = config.get('DB_STATEMENT_TIMEOUT_MS')
+    if timeout and url.drivername.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(int(timeout))}
+    return options
@@ -0,0 +1,158 @@
+import gzip
+import json
+import time
+from flask import current_app, request
+from profiling import add_serialization_time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson',
+                          'text/plain', 'text/csv', 'text/html')
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS |
+                        orjson.OPT_SORT_KEYS)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True,
+                      ensure_ascii=False).encode('utf-8')
+
+
+'''
+JSON encoders by name, each one takes an object and returns UTF-8 bytes
+'''
+ENCODERS = {'json': _json_dumps}
+if orjson is not None:
+    ENCODERS['orjson'] = _orjson_dumps
+
+
+'''
+get_encoder(name)
+    the encoder of name, None picks orjson when it is installed
+    and the standard library json otherwise
+'''
+def get_encoder(name=None):
+    if name is None:
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in ENCODERS:
+        raise ValueError('unknown or not installed JSON encoder {!r}'
+                         .format(name))
+    return ENCODERS[name]
+
+
+'''
+RawJSON
+    bytes of a JSON value encoded beforehand
+RawJSONArray
+    list of RawJSON, a JSON array of them
+    jsonify splices both in as they are when they are top level values
+    of the response
+'''
+class RawJSON(bytes):
+    pass
+
+
+class RawJSONArray(list):
+    pass
+
+
+def _raw_json(value):
+    if isinstance(value, RawJSONArray):
+        return b'[' + b','.join(value) + b']'
+    return value
+
+
+'''
+encode_with_raw_json(encoder, data)
+    encodes data with encoder, the RawJSON and RawJSONArray values of
+    the top level of data are replaced by placeholder strings and the
+    encoded placeholders by the raw bytes
+'''
+def encode_with_raw_json(encoder, data):
+    if not isinstance(data, dict) or not any(
+            isinstance(value, (RawJSON, RawJSONArray))
+            for value in data.values()):
+        return encoder(data)
+    raw = {}
+    data = dict(data)
+    for key, value in data.items():
+        if isinstance(value, (RawJSON, RawJSONArray)):
+            placeholder = '\x00raw json {}\x00'.format(len(raw))
+            raw[encoder(placeholder)] = _raw_json(value)
+            data[key] = placeholder
+    body = encoder(data)
+    for placeholder, value in raw.items():
+        body = body.replace(placeholder, value, 1)
+    return body
+
+
+'''
+jsonify
+    same as flask.jsonify with the JSON encoder of the application,
+    its time is added to the profile of the request.
+    top level RawJSON and RawJSONArray values are spliced in
+'''
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both '
+                        'args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    start = time.perf_counter()
+    body = encode_with_raw_json(current_app.extensions['json_encoder'], data)
+    add_serialization_time(time.perf_counter() - start)
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def _compress(body, encoding, level):
+    if encoding == 'br':
+        # brotli qualities go to 11, keep the cost close to gzip's level
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level)
+
+
+'''
+init_encoding(app)
+    sets the JSON encoder of jsonify (JSON_ENCODER) and compresses the
+    responses of COMPRESS_MIN_SIZE bytes or more with brotli or gzip,
+    as negotiated by Accept-Encoding. streamed responses are not touched.
+    the ETag of a compressed response gets the encoding as suffix,
+    http_cache accepts it back in If-None-Match
+'''
+def init_encoding(app):
+    app.extensions['json_encoder'] = get_encoder(app.config['JSON_ENCODER'])
+    min_size = app.config['COMPRESS_MIN_SIZE']
+    level = app.config['COMPRESS_LEVEL']
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    @app.after_request
+    def compress(response):
+        if (response.direct_passthrough or response.is_streamed or
+                response.status_code != 200 or
+                'Content-Encoding' in response.headers or
+                response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings)
+        body = response.get_data()
+        if encoding is None or len(body) < min_size:
+            return response
+        response.set_data(_compress(body, encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag('{}-{}'.format(etag, encoding), weak)
+        return response
@@ -1,21 +1,143 @@
+import io
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, current_app, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
-from models import setup_db, Question, Category, paginate_questions
+from models import setup_db, db, Question, database_source, \
+    on_question_change, parse_fields, delete_questions, find_duplicate
+from snapshot import SnapshotSource, install_reload_signal
+from group_commit import GroupCommitter, WRITE_TIMEOUT
+from quiz_sessions import QuizSession, InMemoryQuizSessionStore
+from search import create_search_backend
+from suggest import SuggestIndex, suggest_terms
+from category_cache import CategoryCache
+from fragment_cache import QuestionFragmentCache
+from question_index import QuestionIdIndex, ALL_CATEGORIES, paginate_ids
+from http_cache import BankVersion, conditional
+from bulk_import import import_questions, read_csv, read_ndjson
+from bulk_export import export_rows, ndjson_lines, csv_lines
+from profiling import init_profiling, instrument_engine
+from routing import init_replicas, read_only
+from rate_limit import init_rate_limits
+from encoding import init_encoding, jsonify
+from config import Config, engine_options
+from migrations import upgrade, dedupe_questions, MIGRATION_BATCH_SIZE
+import click
 
 
 QUESTIONS_PER_PAGE = 10
+# routes that change the question bank, rejected in snapshot mode
+WRITE_ENDPOINTS = ('createQuestion', 'bulkCreateQuestions', 'deleteQuestion',
+                   'bulkDeleteQuestions')
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson',
+                    'application/jsonl')
+CSV_MIMETYPES = ('text/csv', 'application/csv')
 
 
-def create_app():
+def validate_question(questionData, categories=None):
+    '''
+    check the question, answer, difficulty and category of a new question,
+    the category must be one of the ids of categories when given
+    return the values to insert
+    raise ValueError with the reason if one is missing or not valid
+    '''
+    values = {}
+    for field in ('question', 'answer', 'difficulty', 'category'):
+        value = questionData.get(field)
+        if value is None or value == '':
+            raise ValueError('{} is required'.format(field))
+        values[field] = value
+    for field in ('difficulty', 'category'):
+        # category ids may come as strings, e.g. "5" from forms or CSV
+        try:
+            values[field] = int(values[field])
+        except (TypeError, ValueError):
+            raise ValueError('{} must be a number'.format(field))
+    if categories is not None and values['category'] not in categories:
+        raise ValueError('category {} does not exist'.format(
+            values['category']))
+    return values
+
+
+def request_fields():
+    '''
+    the question columns of the fields= parameter of the request
+    return None for every column
+    abort 400 if a field is not a question column
+    '''
+    try:
+        return parse_fields(request.args.get('fields'))
+    except ValueError:
+        abort(400)
+
+
+def create_app(config=None):
     '''
     create and configure the Flask application
+    config: object or dict of settings that replace the defaults
+        of config.Config (which are read from the environment)
     return Flask application
     '''
     app = Flask(__name__)
+    app.config.from_object(Config())
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
     setup_db(app)
+    # quiz sessions store, replace the extension to plug another store
+    app.extensions['quiz_sessions'] = InMemoryQuizSessionStore(
+        app.config['QUIZ_MAX_SESSIONS'])
+    # the indexes and caches read the database, or the snapshot
+    source = database_source
+    if app.config['SNAPSHOT_MODE']:
+        source = SnapshotSource()
+        app.extensions['snapshot'] = source
+        install_reload_signal(app, source)
+    # the snapshot only changes with a reload, nothing to check
+    search_index_ttl = app.config['SEARCH_INDEX_TTL'] \
+        if source is database_source else None
+    search = create_search_backend(
+        app.config['SEARCH_BACKEND'] if source is database_source else None,
+        source, search_index_ttl)
+    app.extensions['search'] = search
+    on_question_change(app, search.on_question_change)
+    suggest = SuggestIndex(app.config['SUGGEST_MAX_TOKENS'], source,
+                           search_index_ttl)
+    app.extensions['suggest'] = suggest
+    on_question_change(app, suggest.on_question_change)
+    categories_cache = CategoryCache(app.config['CATEGORY_CACHE_TTL'],
+                                     source)
+    app.extensions['categories'] = categories_cache
+    if source is not database_source:
+        on_question_change(app, categories_cache.on_question_change)
+    # sorted question ids by category for totals, pages and random picks
+    question_index = QuestionIdIndex(
+        app.config['QUESTION_INDEX_MAX_IDS'], source,
+        app.config['QUESTION_INDEX_TTL'] if source is database_source
+        else None)
+    app.extensions['question_index'] = question_index
+    on_question_change(app, question_index.on_question_change)
+    bank_version = BankVersion(source.bank_version,
+                               app.config['BANK_VERSION_TTL'])
+    app.extensions['bank_version'] = bank_version
+    on_question_change(app, bank_version.bump)
+
+    # one transaction for the writes of GROUP_COMMIT_WINDOW_MS
+    committer = None
+    if app.config['GROUP_COMMIT_WINDOW_MS']:
+        committer = GroupCommitter(
+            app, app.config['GROUP_COMMIT_WINDOW_MS'] / 1000.0,
+            app.config['GROUP_COMMIT_MAX_BATCH'])
+        app.extensions['group_commit'] = committer
+
+    def delete_ids(question_ids):
+        if committer is not None:
+            return committer.delete(question_ids).result(WRITE_TIMEOUT)
+        return delete_questions(question_ids)
+
+    def questions_version():
+        return '{}-{}'.format(bank_version, categories_cache.get().etag)
     # Set up CORS. Allow '*' for origins
     CORS(app, resources={r"/*": {"origins": "*"}})
 
@@ -33,28 +155,127 @@ def create_app():
                              'GET,PUT,POST,DELETE,OPTIONS,PATCH')
         return response
 
+    # wall time, SQL and serialization time of every request
+    metrics = init_profiling(app, db.engine)
+    # rate limits and concurrency cap, checked before the views
+    # take a database connection
+    init_rate_limits(app, metrics)
+    # read requests on the DATABASE_REPLICA_URLS replicas
+    replicas = init_replicas(app, db, engine_options)
+    if replicas is not None:
+        for engine in replicas.engines:
+            instrument_engine(engine)
+    # JSON encoder of jsonify and response compression
+    init_encoding(app)
+    # encoded JSON of the questions, spliced into the responses
+    fragment_cache = None
+    if app.config['QUESTION_FRAGMENT_CACHE_SIZE']:
+        fragment_cache = QuestionFragmentCache(
+            app.config['QUESTION_FRAGMENT_CACHE_SIZE'],
+            app.extensions['json_encoder'], source, metrics.counter(
+                'trivia_question_fragment_cache_total',
+                'Question JSON fragment cache hits, misses and evictions.',
+                ('result',)),
+            app.config['QUESTION_FRAGMENT_CACHE_TTL']
+            if source is database_source else None)
+        app.extensions['question_fragments'] = fragment_cache
+        on_question_change(app, fragment_cache.on_question_change)
+
+    def load_questions(question_ids, fields=None):
+        '''
+        the questions of question_ids in their order, from the fragment
+        cache when every field is asked
+        '''
+        if fields is not None or fragment_cache is None:
+            return source.questions_by_ids(question_ids, fields)
+        return fragment_cache.fragments(question_ids)
+
+    @app.cli.command('db-upgrade')
+    @click.option('--batch-size', default=MIGRATION_BATCH_SIZE,
+                  help='rows copied in one transaction')
+    def dbUpgrade(batch_size):
+        '''
+        apply the schema migrations of migrations.py to the database
+        '''
+        applied = upgrade(db.engine, batch_size, log=click.echo)
+        click.echo('applied {} migrations'.format(len(applied)))
+
+    @app.cli.command('dedupe-questions')
+    @click.option('--batch-size', default=MIGRATION_BATCH_SIZE,
+                  help='rows checked in one transaction')
+    @click.option('--delete', is_flag=True,
+                  help='delete the duplicates instead of reporting them')
+    def dedupeQuestions(batch_size, delete):
+        '''
+        set the content hash of the questions without one and report
+        those that duplicate another question (delete them with --delete)
+        '''
+        hashed, duplicates = dedupe_questions(db.engine, batch_size,
+                                              log=click.echo, delete=delete)
+        click.echo('hashed {} questions, {} {} duplicates'.format(
+            hashed, 'deleted' if delete else 'found', len(duplicates)))
+
+    if source is not database_source:
+        @app.before_request
+        def reject_writes():
+            '''
+            the snapshot is read-only, write requests get 405
+            '''
+            if request.endpoint in WRITE_ENDPOINTS:
+                abort(405)
+
+    @app.route('/snapshot/reload', methods=['POST'])
+    def reloadSnapshot():
+        '''
+        An endpoint to load the question bank again in snapshot mode,
+        the new snapshot replaces the old one at once (SIGHUP does the same)
+        return the number of questions and categories of the new snapshot
+        if not in snapshot mode return 404
+        '''
+        if source is database_source:
+            abort(404)
+        snapshot = source.reload()
+        return jsonify({
+            'success': True,
+            'totalQuestions': len(snapshot),
+            'totalCategories': len(snapshot.categories),
+            'loaded_at': snapshot.loaded_at
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def getMetrics():
+        '''
+        Prometheus metrics endpoint
+        return histograms of the time, SQL statements, SQL time
+        and serialization time of the requests by endpoint
+        '''
+        return current_app.response_class(
+            metrics.expose(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/categories', methods=['GET'])
     @app.route('/category', methods=['GET'])
+    @conditional(lambda: categories_cache.get().etag,
+                 'CATEGORIES_CACHE_MAX_AGE')
     def getAllCategories():
         '''
         Get all categories/category endpoint
         This endpoint returns all categories or
         status code 500 if there is a server error
+        categories come from the category cache and have an ETag,
+        If-None-Match with the same ETag return 304 Not Modified
         '''
         try:
-            categories = {}
-            category_query = Category.query.all()
-            for category in category_query:
-                categories[category.id] = category.type.format()
+            categories = categories_cache.get()
             return jsonify({
                 'success': True,
-                'categories': categories
+                'categories': categories.categories
             })
         except Exception:
             abort(500)
 
     @app.route('/question', methods=['GET'])
     @app.route('/questions', methods=['GET'])
+    @conditional(questions_version, 'QUESTIONS_CACHE_MAX_AGE')
     def getQuestions():
         '''
       An endpoint to handle GET requests for questions,
@@ -64,23 +285,45 @@ def create_app():
       and return 404 if not found page
       QUESTIONS_PER_PAGE = 10 global define var
       Two routes if use in traminal you can use single or collection sentence
+      pass ?after=<id> instead of ?page= for keyset pagination,
+          the response then has next_cursor (null on the last page)
+      pass ?fields=id,question,... to get only these fields of the questions
         '''
-        questions = Question.query.order_by(Question.id).all()
-        total_questions = len(questions)
-        category_query = Category.query.order_by(Category.id).all()
-        current_questions = paginate_questions(
-            request, questions,
-            QUESTIONS_PER_PAGE)
+        current_questions, total_questions, next_cursor = \
+            paginate_ids(request, question_index, ALL_CATEGORIES,
+                         QUESTIONS_PER_PAGE, request_fields(),
+                         load_questions)
         if (len(current_questions) == 0):
             abort(404)
-        categories = {}
-        for category in category_query:
-            categories[category.id] = category.type
-        return jsonify({
+        result = {
             'success': True,
             'questions': current_questions,
             'totalQuestions': total_questions,
-            'categories': categories
+            'categories': categories_cache.get().categories
+        }
+        if 'after' in request.args:
+            result['next_cursor'] = next_cursor
+        return jsonify(result)
+
+    @app.route('/bootstrap', methods=['GET'])
+    @conditional(questions_version, 'QUESTIONS_CACHE_MAX_AGE')
+    def getBootstrap():
+        '''
+        An endpoint with everything the frontend needs to start:
+        categories, first page of questions, totalQuestions and
+        version of the question bank, in one response.
+        categories and the question ids come from the caches, the
+        questions of the page are one query.
+        it has the ETag of the question routes
+        '''
+        question_ids = question_index.page(ALL_CATEGORIES, 0,
+                                           QUESTIONS_PER_PAGE)
+        return jsonify({
+            'success': True,
+            'categories': categories_cache.get().categories,
+            'questions': load_questions(question_ids),
+            'totalQuestions': question_index.total(ALL_CATEGORIES),
+            'version': questions_version()
         })
 
     @app.route('/question/<int:question_id>', methods=['DELETE'])
@@ -93,8 +336,8 @@ def create_app():
         or collection sentence
         '''
         try:
-            question = Question.query.get(question_id)
-            question.delete()
+            if not delete_ids([question_id]):
+                abort(422)
             return jsonify({
               'success': True,
               'message': "Question successfully deleted",
@@ -103,6 +346,34 @@ def create_app():
         except Exception:
             abort(422)
 
+    @app.route('/questions', methods=['DELETE'])
+    def bulkDeleteQuestions():
+        '''
+        An endpoint to DELETE many questions at once,
+        the body is {"ids": [question ids]} (at most BULK_DELETE_MAX_IDS),
+        they are deleted by one statement in one transaction.
+        return deleted ids and not_found ids
+        if ids is not a list of numbers return 400
+        '''
+        question_ids = (request.get_json(silent=True) or {}).get('ids')
+        if not isinstance(question_ids, list) or not question_ids or \
+                len(question_ids) > current_app.config['BULK_DELETE_MAX_IDS']:
+            abort(400)
+        if not all(isinstance(question_id, int) and
+                   not isinstance(question_id, bool)
+                   for question_id in question_ids):
+            abort(400)
+        try:
+            deleted = [question['id']
+                       for question in delete_ids(question_ids)]
+        except Exception:
+            abort(422)
+        return jsonify({
+            'success': True,
+            'deleted': deleted,
+            'not_found': sorted(set(question_ids) - set(deleted))
+        })
+
     @app.route('/questions', methods=['POST'])
     def createQuestion():
         '''
@@ -111,41 +382,133 @@ def create_app():
     category, and difficulty score.
     if question or answer text, category,
      or difficulty score not exit get 422 unprocessable.
+    if a question with the same normalized question and answer
+     exists get 409 conflict.
     return and insert: question and answer text,
     category, and difficulty score
         '''
         questionData = ''
         questionData = request.get_json()
-        question = questionData.get('question')
-        answer = questionData.get('answer')
-        difficulty = questionData.get('difficulty')
-        category = questionData.get('category')
-        print(question)
-        if ((question == '') or (answer == '') or
-                (difficulty == '') or (category == '')):
+        try:
+            values = validate_question(questionData,
+                                       categories_cache.get().categories)
+        except ValueError:
             abort(422)
+        if find_duplicate(db.session, values) is not None:
+            abort(409)
         try:
-            questionInsert = Question(question=question, answer=answer,
-                                      difficulty=difficulty,
-                                      category=category)
-            questionInsert.insert()
+            if committer is not None:
+                committer.insert(values).result(WRITE_TIMEOUT)
+            else:
+                Question(**values).insert()
             return jsonify({
               'success': True,
-              'question': question,
-              'answer': answer,
-              'difficulty': difficulty,
-              'category': category
+              'question': values['question'],
+              'answer': values['answer'],
+              'difficulty': values['difficulty'],
+              'category': values['category']
             })
         except Exception:
+            # the same question inserted meanwhile breaks the unique index
+            db.session.rollback()
+            if find_duplicate(db.session, values) is not None:
+                abort(409)
             abort(422)
 
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulkCreateQuestions():
+        '''
+    An endpoint to POST many new questions at once.
+    the body is NDJSON (one question object per line) or CSV with
+    a question,answer,difficulty,category header, it is read as a stream
+    and every row is checked like POST /questions.
+    the rows are inserted in batches (?batch_size=, default
+    BULK_IMPORT_BATCH_SIZE), one transaction per batch. rows with the
+    content of a question of the bank or of an earlier row are skipped.
+    return inserted, failed and duplicate rows and errors with the line
+    of each error
+    if the body is not NDJSON or CSV or batch_size is not valid return 400
+        '''
+        batch_size = request.args.get(
+            'batch_size', current_app.config['BULK_IMPORT_BATCH_SIZE'],
+            type=int)
+        if batch_size < 1:
+            abort(400)
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8',
+                                  newline='')
+        if request.mimetype in NDJSON_MIMETYPES:
+            rows = read_ndjson(stream)
+        elif request.mimetype in CSV_MIMETYPES:
+            rows = read_csv(stream)
+        else:
+            abort(400)
+        try:
+            categories = categories_cache.get().categories
+            result = import_questions(
+                rows, lambda row: validate_question(row, categories),
+                batch_size)
+        except UnicodeDecodeError:
+            abort(400)
+        return jsonify({
+            'success': True,
+            'inserted': result['inserted'],
+            'failed': result['failed'],
+            'duplicates': result['duplicates'],
+            'errors': result['errors']
+        })
+
+    @app.route('/questions/export', methods=['GET'])
+    def exportQuestions():
+        '''
+    A GET endpoint to download the question bank.
+    ?format=ndjson (default) or csv, ?category=<id> for one category.
+    the rows are read from a server-side cursor and streamed
+        as they are read, so memory does not grow with the bank
+    if format is not ndjson or csv return 400
+        '''
+        export_format = request.args.get('format', 'ndjson')
+        category = request.args.get('category', None, type=int)
+        if export_format == 'ndjson':
+            lines, mimetype = ndjson_lines, 'application/x-ndjson'
+        elif export_format == 'csv':
+            lines, mimetype = csv_lines, 'text/csv'
+        else:
+            abort(400)
+        response = current_app.response_class(
+            stream_with_context(lines(export_rows(category))),
+            mimetype=mimetype)
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=questions.{}'.format(export_format)
+        return response
+
+    @app.route('/questions/suggest', methods=['GET'])
+    def suggestQuestions():
+        '''
+    A GET endpoint for search-as-you-type.
+    complete the last word of ?q= with the words of the questions,
+    the words of the most questions first, ?limit= (default 10,
+    at most 50) suggestions.
+    the words come from an in-memory index, not the database.
+    if limit not valid return 400
+        '''
+        limit = request.args.get('limit', 10, type=int)
+        if not 1 <= limit <= 50:
+            abort(400)
+        return jsonify({
+            'success': True,
+            'suggestions': suggest_terms(suggest, request.args.get('q', ''),
+                                         limit)
+        })
+
     @app.route('/questions/search', methods=['POST'])
+    @read_only
     def searchQuestion():
         '''
   A POST endpoint to get questions based on a search term.
-    return any questions for whom the search term is
-    a substring of the question,
-        totalQuestions and current_category
+    return the questions that have every word of the search term,
+        best matches first and 10 questions in each page (?page=),
+        totalQuestions (number of all matches) and current_category
+        ?fields=id,question,... to get only these fields of the questions
     if search term return 422
     if not exit return 404 not found
         '''
@@ -153,55 +516,60 @@ def create_app():
         searchData = request.get_json()
         searchTerm = searchData.get('searchTerm', '')
         if searchTerm == '':
-            print("sear")
             abort(422)
+        fields = request_fields()
         try:
-            question1 = ''
-            question1 = Question.query.filter(
-                Question.question.ilike(f'%{searchTerm}%')).all()
-            if question1 == 0:
+            page = request.args.get('page', 1, type=int)
+            question_ids, total_questions = \
+                current_app.extensions['search'].search(
+                    searchTerm, max(page - 1, 0) * QUESTIONS_PER_PAGE,
+                    QUESTIONS_PER_PAGE)
+            current_questions = load_questions(question_ids, fields)
+            if len(current_questions) == 0:
                 abort(404)
-            else:
-                current_questions = paginate_questions(
-                  request, question1,
-                  QUESTIONS_PER_PAGE)
-                for category in current_questions:
-                    current_category = category['category']
-                return jsonify({
-                  'success': True,
-                  'questions': current_questions,
-                  'totalQuestions': len(current_questions),
-                  'current_category': current_category
-                })
+            current_category = current_questions[-1].get('category')
+            return jsonify({
+              'success': True,
+              'questions': current_questions,
+              'totalQuestions': total_questions,
+              'current_category': current_category
+            })
         except Exception:
                 abort(404)
 
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @conditional(questions_version, 'QUESTIONS_CACHE_MAX_AGE')
     def getQuestionsOnCategory(category_id):
         '''
         A GET endpoint to get questions based on category.
         return: return 'success': True, get maximum 10 questions,
             totalQuestions, type of category
+            (next_cursor too when paging with ?after=<id>)
+            ?fields=id,question,... to get only these fields of the questions
         if any problem like category not exit except 404
         '''
+        fields = request_fields()
         try:
-            category_query = Category.query.filter_by(
-                id=category_id).one_or_none()
-            questions = Question.query.filter_by(category=category_id).all()
-            total_questions = len(questions)
-            current_questions = paginate_questions(
-                request, questions,
-                QUESTIONS_PER_PAGE)
-            return jsonify({
+            categories = categories_cache.get()
+            if category_id not in categories.categories:
+                abort(404)
+            current_questions, total_questions, next_cursor = \
+                paginate_ids(request, question_index, category_id,
+                             QUESTIONS_PER_PAGE, fields, load_questions)
+            result = {
                 'success': True,
                 'questions': current_questions,
                 'totalQuestions': total_questions,
-                'categories': category_query.type
-            })
+                'categories': categories.categories[category_id]
+            }
+            if 'after' in request.args:
+                result['next_cursor'] = next_cursor
+            return jsonify(result)
         except Exception:
             abort(404)
 
     @app.route('/quizzes', methods=['POST'])
+    @read_only
     def quizPlay():
         '''
   A POST endpoint to get questions to play the quiz.
@@ -209,42 +577,114 @@ def create_app():
   parameters from POST requset
   and return a random questions within the given category,
   if provided, and that is not one of the previous questions.
-  if quiz_category empty or previous_questions empty return 400 bad request
+  count (default 1, at most QUIZ_MAX_COUNT) asks for up to count
+  distinct questions at once, they are in questions and the first
+  one is also in question.
+  exhausted is true when no unseen question is left after these,
+  question is null when there was none left.
+  if quiz_category empty or previous_questions empty
+  or count not valid return 400 bad request
         '''
-        quizData = request.get_json()
+        quizData = request.get_json() or {}
         previous_questions = quizData.get('previous_questions', '')
         quiz_category = quizData.get('quiz_category', '')
-        if ((quiz_category is None) or (previous_questions is None)):
+        if ((quiz_category is None) or (previous_questions is None)
+                or not isinstance(previous_questions or [], list)):
+            abort(400)
+        try:
+            count = int(quizData.get('count', 1))
+            category_id = int(quiz_category['id'])
+            # the ids are compared with the int ids of the index
+            previous_questions = [int(question_id) for question_id
+                                  in previous_questions or ()]
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+        if not 1 <= count <= current_app.config['QUIZ_MAX_COUNT']:
             abort(400)
-        category_id = int(quiz_category['id'])
         if category_id == 0:
-            questions = Question.query.all()
-        else:
-            questions = Question.query.filter_by(
-                    category=category_id).all()
-
-        def getRandomQuestions():
-            '''
-          find the random question that not in the previous questions
-          random the <int:id> of question
-          if exit in previous questions recall self until found
-          elamunt not-exit
-          return random question not exit in previous questions
-            '''
-            randomQuestions = questions[random.randint(0, len(questions)-1)]
-            if randomQuestions.id in previous_questions:
-                return getRandomQuestions()
-            else:
-                return randomQuestions
-        nextQ = getRandomQuestions()
+            category_id = ALL_CATEGORIES
+        question_ids, remaining = question_index.random_ids(
+            category_id, count, previous_questions)
+        # one query, questions deleted by another process are skipped
+        questions = load_questions(question_ids)
         return jsonify({
                 'success': True,
-                'question': nextQ.format()
+                'question': questions[0] if questions else None,
+                'questions': questions,
+                'exhausted': remaining <= count
+        })
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @read_only
+    def startQuizSession():
+        '''
+  A POST endpoint to start a quiz session.
+  take quiz_category from the POST request and shuffle the ids
+  of its questions once (id 0 is all categories),
+  the session expires after QUIZ_SESSION_TTL seconds without use.
+  return session_id, totalQuestions and expires_in
+  if quiz_category empty return 400 bad request
+        '''
+        quizData = request.get_json() or {}
+        quiz_category = quizData.get('quiz_category')
+        if not quiz_category:
+            abort(400)
+        try:
+            category_id = int(quiz_category['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+        question_ids = question_index.ids(
+            category_id if category_id != 0 else ALL_CATEGORIES)
+        ttl = current_app.config['QUIZ_SESSION_TTL']
+        session = QuizSession(category_id, question_ids, ttl)
+        current_app.extensions['quiz_sessions'].save(session)
+        return jsonify({
+            'success': True,
+            'session_id': session.id,
+            'totalQuestions': session.total,
+            'expires_in': ttl
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    @read_only
+    def nextQuizQuestion(session_id):
+        '''
+  A POST endpoint to get the next question of a quiz session.
+  return the question (null when the deck is empty) and remaining
+  if the session not exit or expired return 404
+        '''
+        session = current_app.extensions['quiz_sessions'].get(session_id)
+        if session is None:
+            abort(404)
+        nextQ = None
+        while nextQ is None:
+            question_id = session.next_id()
+            if question_id is None:
+                break
+            # skip the questions deleted since the session started
+            questions = load_questions([question_id])
+            nextQ = questions[0] if questions else None
+        return jsonify({
+            'success': True,
+            'question': nextQ,
+            'remaining': session.remaining()
+        })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def endQuizSession(session_id):
+        '''
+  A DELETE endpoint to end a quiz session before it expires.
+        '''
+        current_app.extensions['quiz_sessions'].delete(session_id)
+        return jsonify({
+            'success': True,
+            'session_id': session_id
         })
 
     '''
   Error handlers for all expected errors
-  including 404, 422, 400, and 500.
+  including 404, 405, 409, 422, 400, and 500
+  (429 and 503 of the rate limits are in rate_limit.py).
     '''
     @app.errorhandler(404)
     def not_found(error):
@@ -254,6 +694,22 @@ def create_app():
             "message": "resource not found"
         }), 404
 
+    @app.errorhandler(405)
+    def method_not_allowed(error):
+        return jsonify({
+            "success": False,
+            "error": 405,
+            "message": "method not allowed"
+        }), 405
+
+    @app.errorhandler(409)
+    def conflict(error):
+        return jsonify({
+            "success": False,
+            "error": 409,
+            "message": "question already exists"
+        }), 409
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -0,0 +1,130 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from encoding import RawJSON, RawJSONArray
+from models import database_source
+from profiling import add_serialization_time
+
+
+'''
+QuestionFragment
+    the encoded JSON of a question, with its id and category so the
+    routes can read them like the question dict
+'''
+class QuestionFragment(RawJSON):
+
+    def __new__(cls, json, question_id, category):
+        fragment = RawJSON.__new__(cls, json)
+        fragment.id = question_id
+        fragment.category = category
+        return fragment
+
+    def get(self, field, default=None):
+        if field in ('id', 'category'):
+            return getattr(self, field)
+        return default
+
+
+'''
+QuestionFragmentCache
+    process-local LRU of the encoded JSON of at most max_entries
+    questions by id, so the responses splice the bytes of the questions
+    instead of encoding them again. the questions are read from source
+    (models.DatabaseSource by default) and encoded with encoder.
+    on_question_change evicts the changed question ('reload' evicts
+    every one) and bumps the version of the cache: questions read before
+    a change are returned but not kept, so a read that raced with a
+    write does not keep the old row. the notifications only come from
+    this process, so a question is read again ttl seconds after it was
+    kept: a change of another process is served for ttl seconds at most
+    (ttl None keeps the questions until they are evicted).
+    hits, misses and evictions are counted in counter
+    (a profiling.LabeledCounter of one 'result' label) when given
+'''
+class QuestionFragmentCache:
+
+    def __init__(self, max_entries, encoder, source=database_source,
+                 counter=None, ttl=None):
+        self.max_entries = max_entries
+        self.encoder = encoder
+        self.source = source
+        self.counter = counter
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fragments(self, question_ids):
+        '''
+        return RawJSONArray of the QuestionFragment of question_ids in
+            their order, the ids not found are skipped
+        '''
+        found = {}
+        missing = []
+        expired = 0
+        now = time.monotonic()
+        with self._lock:
+            version = self.version
+            for question_id in question_ids:
+                entry = self._entries.get(question_id)
+                if entry is not None and entry[1] <= now:
+                    del self._entries[question_id]
+                    expired += 1
+                    entry = None
+                if entry is None:
+                    missing.append(question_id)
+                else:
+                    self._entries.move_to_end(question_id)
+                    found[question_id] = entry[0]
+        self._count('hit', len(found))
+        self._count('miss', len(missing))
+        self._count('eviction', expired)
+        if missing:
+            loaded = self._load(missing)
+            found.update(loaded)
+            self._keep(loaded, version)
+        return RawJSONArray(found[question_id] for question_id
+                            in question_ids if question_id in found)
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            self.version += 1
+            if action == 'reload':
+                evicted = len(self._entries)
+                self._entries.clear()
+            else:
+                evicted = int(self._entries.pop(question['id'], None)
+                              is not None)
+        self._count('eviction', evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self, question_ids):
+        questions = self.source.questions_by_ids(question_ids)
+        start = time.perf_counter()
+        loaded = {question['id']: QuestionFragment(
+            self.encoder(question), question['id'], question['category'])
+            for question in questions}
+        add_serialization_time(time.perf_counter() - start)
+        return loaded
+
+    def _keep(self, fragments, version):
+        evicted = 0
+        with self._lock:
+            if version != self.version:
+                return
+            expires_at = math.inf if self.ttl is None else \
+                time.monotonic() + self.ttl
+            self._entries.update(
+                (question_id, (fragment, expires_at))
+                for question_id, fragment in fragments.items())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        self._count('eviction', evicted)
+
+    def _count(self, result, amount):
+        if self.counter is not None and amount:
+            self.counter.inc(result, amount=amount)
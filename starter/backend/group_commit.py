@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from models import db, insert_question, delete_question_rows, \
+    bump_bank_version, notify_question_change
+
+
+# seconds a request waits for the result of its write
+WRITE_TIMEOUT = 30
+
+
+'''
+GroupCommitter
+    group commit of the question writes: a thread takes the inserts and
+    deletes submitted during window seconds (at most max_batch of them)
+    and runs them in one transaction, so concurrent requests share one
+    commit. insert and delete return a Future of the result of the write.
+    when the transaction fails each write of the batch is retried alone,
+    so a bad write only fails its own request
+'''
+class GroupCommitter:
+
+    def __init__(self, app, window=0.005, max_batch=100):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        # transactions committed and writes in them
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        thread = threading.Thread(target=self._run, daemon=True,
+                                  name='group-commit')
+        thread.start()
+
+    def insert(self, values):
+        '''
+        return Future of the formatted new question
+        '''
+        return self._submit('insert', values)
+
+    def delete(self, question_ids):
+        '''
+        return Future of the formatted deleted questions
+        '''
+        return self._submit('delete', question_ids)
+
+    def _submit(self, action, argument):
+        future = Future()
+        self._queue.put((action, argument, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            with db.engine.begin() as connection:
+                results = [self._apply(connection, action, argument)
+                           for action, argument, _ in batch]
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0][2].set_exception(error)
+            else:
+                for write in batch:
+                    self._commit([write])
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        if any(results):
+            # the writes are committed, a failed bump only delays
+            # the new ETags until the next write
+            try:
+                with db.engine.begin() as connection:
+                    bump_bank_version(connection)
+            except Exception:
+                self.app.logger.exception('bank version bump failed')
+        for (action, _, future), result in zip(batch, results):
+            try:
+                for question in result if action == 'delete' else [result]:
+                    notify_question_change(action, question)
+            except Exception:
+                self.app.logger.exception('question listener failed')
+            future.set_result(result)
+
+    def _apply(self, connection, action, argument):
+        if action == 'insert':
+            return insert_question(connection, argument)
+        return delete_question_rows(connection, argument)
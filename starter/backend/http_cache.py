@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from flask import current_app, request, make_response
+
+
+'''
+BankVersion
+    the version of the question bank of read() (the bank_version of the
+    source: the database row that every question write bumps, or the
+    version of the snapshot), the same in every process. it is read at
+    most every ttl seconds, so a change of another process is seen after
+    ttl seconds; bump (register it as a question listener) makes the next
+    use read it again, so this process sees its own changes at once
+'''
+class BankVersion:
+
+    def __init__(self, read, ttl=1):
+        self.read = read
+        self.ttl = ttl
+        self.value = None
+        self._read_at = 0
+        self._bumps = 0
+        self._lock = threading.Lock()
+
+    def bump(self, action=None, question=None):
+        with self._lock:
+            self._bumps += 1
+            self.value = None
+
+    def __str__(self):
+        value = self.value
+        if value is None or time.monotonic() - self._read_at >= self.ttl:
+            bumps = self._bumps
+            value = self.read()
+            with self._lock:
+                # a bump during the read may have missed the new version
+                if bumps == self._bumps:
+                    self.value = value
+                    self._read_at = time.monotonic()
+        return str(value)
+
+
+'''
+make_etag(*parts)
+    strong ETag value of the version parts and the request path and args
+'''
+def make_etag(*parts):
+    key = '|'.join(str(part) for part in parts + (request.full_path,))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+'''
+not_modified_etag(etag)
+    the ETag of If-None-Match that is etag, alone or with the suffix
+    a compressed response adds to it, None if there is not one
+'''
+def not_modified_etag(etag):
+    for suffix in ('', '-gzip', '-br'):
+        if etag + suffix in request.if_none_match:
+            return etag + suffix
+    return None
+
+
+'''
+cache_control(max_age)
+    Cache-Control header value, no-cache (always revalidate) for 0
+'''
+def cache_control(max_age):
+    if max_age and max_age > 0:
+        return 'public, max-age={}'.format(int(max_age))
+    return 'no-cache'
+
+
+'''
+conditional(version, max_age_config)
+    decorator for GET routes: the ETag is built from version() and the
+    request, If-None-Match with that ETag returns 304 before the route
+    runs (so before any query). 200 responses get the ETag and a
+    Cache-Control max-age read from the app config key max_age_config
+'''
+def conditional(version, max_age_config=None):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = make_etag(version())
+            matched = not_modified_etag(etag)
+            if matched:
+                response = current_app.response_class(status=304)
+                response.set_etag(matched)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            max_age = current_app.config.get(max_age_config, 0) \
+                if max_age_config else 0
+            response.headers['Cache-Control'] = cache_control(max_age)
+            return response
+        return wrapper
+    return decorator
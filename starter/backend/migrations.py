@@ -0,0 +1,380 @@
+import datetime
+from sqlalchemy import bindparam, inspect, text
+
+
+MIGRATION_BATCH_SIZE = 5000
+
+
+'''
+ensure_version_table(connection)
+    creates schema_version, one row per applied migration
+'''
+def ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, '
+        'applied_at VARCHAR NOT NULL)'))
+
+
+def current_version(engine):
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        return connection.execute(text(
+            'SELECT max(version) FROM schema_version')).scalar() or 0
+
+
+def _column_type(engine, table, column):
+    for info in inspect(engine).get_columns(table):
+        if info['name'] == column:
+            return info['type'].__class__.__name__.upper()
+    return None
+
+
+def _id_windows(engine, table, batch_size):
+    with engine.connect() as connection:
+        max_id = connection.execute(text(
+            'SELECT max(id) FROM {}'.format(table))).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        yield start, start + batch_size
+
+
+def _log(log, message):
+    if log is not None:
+        log(message)
+
+
+'''
+migration 1
+    questions.category from a string to an integer foreign key of
+    categories.id, with the (category, id) and (difficulty) indexes of
+    the category listing, quiz and filter queries.
+    PostgreSQL: the values are copied to a new column in batches of
+    batch_size ids, each batch in its own short transaction, while a
+    trigger sets the new column of the rows written meanwhile, then the
+    columns are swapped (and the trigger dropped) under a brief lock,
+    the foreign key is added
+    NOT VALID and validated without blocking writes, and the indexes
+    are built CONCURRENTLY.
+    SQLite cannot change a column type: the table is rebuilt and the rows
+    copied in batches. category values that are not category ids
+    become NULL
+'''
+def _migrate_category_foreign_key(engine, batch_size, log):
+    if engine.dialect.name == 'postgresql':
+        _migrate_category_postgres(engine, batch_size, log)
+    elif engine.dialect.name == 'sqlite':
+        _migrate_category_sqlite(engine, batch_size, log)
+    else:
+        raise RuntimeError('migration 1 does not support {}'.format(
+            engine.dialect.name))
+
+
+# integer of a text category of migration 1, NULL when it is not a number
+CATEGORY_INTEGER = ("CASE WHEN trim({0}::text) ~ '^[0-9]+$' "
+                    "THEN trim({0}::text)::integer END")
+
+
+def _migrate_category_postgres(engine, batch_size, log):
+    if _column_type(engine, 'questions', 'category') != 'INTEGER':
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE questions '
+                'ADD COLUMN IF NOT EXISTS category_new INTEGER'))
+            # the rows written during the copy, also in the windows
+            # already copied, set category_new themselves
+            connection.execute(text(
+                'CREATE OR REPLACE FUNCTION questions_category_new_sync() '
+                'RETURNS trigger AS $$ BEGIN '
+                'NEW.category_new := {}; RETURN NEW; '
+                'END $$ LANGUAGE plpgsql'.format(
+                    CATEGORY_INTEGER.format('NEW.category'))))
+            connection.execute(text(
+                'DROP TRIGGER IF EXISTS questions_category_new_sync '
+                'ON questions'))
+            connection.execute(text(
+                'CREATE TRIGGER questions_category_new_sync '
+                'BEFORE INSERT OR UPDATE OF category ON questions '
+                'FOR EACH ROW EXECUTE PROCEDURE '
+                'questions_category_new_sync()'))
+        for start, end in _id_windows(engine, 'questions', batch_size):
+            with engine.begin() as connection:
+                connection.execute(text(
+                    'UPDATE questions SET category_new = {} '
+                    'WHERE id > :start AND id <= :end'.format(
+                        CATEGORY_INTEGER.format('category'))),
+                    start=start, end=end)
+            _log(log, 'questions.category copied up to id {}'.format(end))
+        with engine.begin() as connection:
+            # the swap, only this transaction blocks the writes and it
+            # is short
+            connection.execute(text(
+                'LOCK TABLE questions IN SHARE ROW EXCLUSIVE MODE'))
+            connection.execute(text(
+                'DROP TRIGGER questions_category_new_sync ON questions'))
+            connection.execute(text(
+                'DROP FUNCTION questions_category_new_sync()'))
+            connection.execute(text(
+                'ALTER TABLE questions DROP COLUMN category'))
+            connection.execute(text(
+                'ALTER TABLE questions RENAME COLUMN category_new '
+                'TO category'))
+    foreign_keys = inspect(engine).get_foreign_keys('questions')
+    if not any(key['constrained_columns'] == ['category']
+               for key in foreign_keys):
+        for start, end in _id_windows(engine, 'questions', batch_size):
+            with engine.begin() as connection:
+                connection.execute(text(
+                    'UPDATE questions SET category = NULL '
+                    'WHERE id > :start AND id <= :end '
+                    'AND category IS NOT NULL AND category NOT IN '
+                    '(SELECT id FROM categories)'), start=start, end=end)
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE questions ADD CONSTRAINT '
+                'questions_category_fkey FOREIGN KEY (category) '
+                'REFERENCES categories (id) NOT VALID'))
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE questions '
+                'VALIDATE CONSTRAINT questions_category_fkey'))
+    connection = engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT')
+    try:
+        connection.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            'ix_questions_category_id ON questions (category, id)'))
+        connection.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            'ix_questions_difficulty ON questions (difficulty)'))
+    finally:
+        connection.close()
+
+
+def _migrate_category_sqlite(engine, batch_size, log):
+    if _column_type(engine, 'questions', 'category') != 'INTEGER':
+        # imported here, models imports the app config
+        from models import Question
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE questions RENAME TO questions_old'))
+            for index in inspect(engine).get_indexes('questions_old'):
+                connection.execute(text('DROP INDEX {}'.format(
+                    index['name'])))
+            Question.__table__.create(connection)
+        for start, end in _id_windows(engine, 'questions_old', batch_size):
+            with engine.begin() as connection:
+                connection.execute(text(
+                    'INSERT INTO questions '
+                    '(id, question, answer, difficulty, category) '
+                    'SELECT id, question, answer, difficulty, '
+                    'CASE WHEN CAST(category AS INTEGER) IN '
+                    '(SELECT id FROM categories) '
+                    'THEN CAST(category AS INTEGER) END '
+                    'FROM questions_old WHERE id > :start AND id <= :end'),
+                    start=start, end=end)
+            _log(log, 'questions copied up to id {}'.format(end))
+        with engine.begin() as connection:
+            connection.execute(text('DROP TABLE questions_old'))
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_questions_category_id '
+            'ON questions (category, id)'))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_questions_difficulty '
+            'ON questions (difficulty)'))
+
+
+'''
+dedupe_questions(engine, batch_size, log, delete)
+    sets the content hash of the questions without one, in windows of
+    batch_size ids in id order, each window in its own transaction.
+    a question whose hash is already in the table or earlier in the
+    window is a duplicate: it keeps a NULL hash, out of the unique
+    index, and is reported (logged with the id of the question it
+    duplicates) for someone to review. delete=True deletes the
+    duplicates instead, so the oldest copy of a question is kept.
+    needs the content_hash column and its unique index
+return the number of hashed questions and the (id, duplicated id)
+    of the duplicates
+'''
+def dedupe_questions(engine, batch_size=MIGRATION_BATCH_SIZE, log=None,
+                     delete=False):
+    # imported here, models imports the app config
+    from models import bump_bank_version, content_hash
+    hashed = 0
+    duplicates = []
+    with engine.connect() as connection:
+        # before migration 3 there is no bank version to bump
+        has_bank_version = engine.dialect.has_table(connection,
+                                                    'bank_version')
+    for start, end in _id_windows(engine, 'questions', batch_size):
+        with engine.begin() as connection:
+            rows = connection.execute(text(
+                'SELECT id, question, answer FROM questions '
+                'WHERE id > :start AND id <= :end '
+                'AND content_hash IS NULL ORDER BY id'),
+                start=start, end=end).fetchall()
+            if not rows:
+                continue
+            hashes = [content_hash(row.question, row.answer) for row in rows]
+            existing = dict(connection.execute(text(
+                'SELECT content_hash, id FROM questions '
+                'WHERE content_hash IN :hashes').bindparams(
+                    bindparam('hashes', expanding=True)),
+                hashes=hashes).fetchall())
+            updates, window_duplicates = [], []
+            for row, row_hash in zip(rows, hashes):
+                if row_hash in existing:
+                    window_duplicates.append((row.id, existing[row_hash]))
+                else:
+                    existing[row_hash] = row.id
+                    updates.append({'id': row.id, 'hash': row_hash})
+            if updates:
+                connection.execute(text(
+                    'UPDATE questions SET content_hash = :hash '
+                    'WHERE id = :id'), updates)
+            if delete and window_duplicates:
+                connection.execute(text(
+                    'DELETE FROM questions WHERE id IN :ids').bindparams(
+                        bindparam('ids', expanding=True)), ids=[
+                            question_id for question_id, _
+                            in window_duplicates])
+        if delete and window_duplicates and has_bank_version:
+            # after the commit, see models.bump_bank_version
+            with engine.begin() as connection:
+                bump_bank_version(connection)
+        hashed += len(updates)
+        duplicates.extend(window_duplicates)
+        for question_id, duplicated_id in window_duplicates:
+            _log(log, 'question {} duplicates question {}{}'.format(
+                question_id, duplicated_id, ', deleted' if delete else ''))
+    return hashed, duplicates
+
+
+'''
+migration 2
+    questions.content_hash with a unique index and the hash of every
+    question set by dedupe_questions. the duplicate questions keep a NULL
+    hash and are only reported, a schema migration does not delete
+    questions (see flask dedupe-questions --delete).
+    the index is built first, while the column is NULL (NULLs are not
+    duplicates), CONCURRENTLY on PostgreSQL
+'''
+def _migrate_content_hash(engine, batch_size, log):
+    columns = [info['name'] for info in inspect(engine).get_columns(
+        'questions')]
+    if 'content_hash' not in columns:
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE questions ADD COLUMN content_hash VARCHAR(64)'))
+    statement = ('CREATE UNIQUE INDEX {} IF NOT EXISTS '
+                 'ix_questions_content_hash ON questions (content_hash)')
+    if engine.dialect.name == 'postgresql':
+        connection = engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        try:
+            connection.execute(text(statement.format('CONCURRENTLY')))
+        finally:
+            connection.close()
+    else:
+        with engine.begin() as connection:
+            connection.execute(text(statement.format('')))
+    dedupe_questions(engine, batch_size, log)
+
+
+'''
+migration 3
+    bank_version, the one row table of the question bank version
+    that the question writes bump (see models.QuestionBankVersion)
+'''
+def _migrate_bank_version(engine, batch_size, log):
+    from models import QuestionBankVersion
+    # the row is inserted with the table
+    QuestionBankVersion.__table__.create(engine, checkfirst=True)
+
+
+'''
+migration 4
+    the GIN index of the full-text search of the questions
+    (search.PostgresSearchBackend), built CONCURRENTLY so the writes go
+    on while it is built. PostgreSQL only, the other databases use the
+    in-process inverted index
+'''
+def _migrate_question_search_index(engine, batch_size, log):
+    if engine.dialect.name != 'postgresql':
+        return
+    # imported here, models imports the app config
+    from search import TS_CONFIG
+    connection = engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT')
+    try:
+        connection.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            'ix_questions_question_tsv ON questions USING gin '
+            "(to_tsvector('{}', coalesce(question, '')))".format(TS_CONFIG)))
+    finally:
+        connection.close()
+
+
+'''
+migration 5
+    bank_version_seq, the sequence of the bank version on PostgreSQL
+    (see models.QuestionBankVersion), set to the version of the
+    bank_version row. the other databases keep the row
+'''
+def _migrate_bank_version_sequence(engine, batch_size, log):
+    if engine.dialect.name != 'postgresql':
+        return
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE SEQUENCE IF NOT EXISTS bank_version_seq'))
+        row = connection.execute(text(
+            'SELECT last_value, is_called FROM bank_version_seq')).first()
+        current = row.last_value if row.is_called else 0
+        version = connection.execute(text(
+            'SELECT version FROM bank_version WHERE id = 1')).scalar() or 0
+        if version > current:
+            connection.execute(text(
+                "SELECT setval('bank_version_seq', :version)"),
+                version=version)
+
+
+'''
+MIGRATIONS
+    (version, description, function(engine, batch_size, log)) in order,
+    every migration checks the schema so it can run on a database that
+    create_all already made current
+'''
+MIGRATIONS = [
+    (1, 'questions.category integer foreign key and indexes',
+     _migrate_category_foreign_key),
+    (2, 'questions.content_hash unique index and duplicates deleted',
+     _migrate_content_hash),
+    (3, 'bank_version table', _migrate_bank_version),
+    (4, 'questions full-text search index', _migrate_question_search_index),
+    (5, 'bank_version_seq sequence', _migrate_bank_version_sequence),
+]
+
+
+'''
+upgrade(engine)
+    applies the migrations newer than the version of the database
+return the applied versions
+'''
+def upgrade(engine, batch_size=MIGRATION_BATCH_SIZE, log=None):
+    applied = []
+    version = current_version(engine)
+    for migration_version, description, migrate in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        _log(log, 'migration {}: {}'.format(migration_version, description))
+        migrate(engine, batch_size, log)
+        with engine.begin() as connection:
+            connection.execute(text(
+                'INSERT INTO schema_version '
+                '(version, description, applied_at) '
+                'VALUES (:version, :description, :applied_at)'),
+                version=migration_version, description=description,
+                applied_at=datetime.datetime.utcnow().isoformat())
+        applied.append(migration_version)
+    return applied
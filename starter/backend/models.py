@@ -1,39 +1,93 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, DDL, \
+    Sequence, create_engine, event, func, select, text
+import hashlib
 import json
+import re
+import unicodedata
 
-database_name = "trivia"
-database_username = 'postgres'
-database_password = '1'
-database_host = 'localhost:5432'
-database_path = "postgres://{}:{}@{}/{}".format(database_username, database_password, database_host, database_name)
+from config import Config, database_path, engine_options
+from routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# reads of the read requests go to the replicas, see routing.py
+db = RoutingSQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database is SQLALCHEMY_DATABASE_URI of the app config
+    unless database_path is given, the pool is set by the DB_* settings
+    of the app config. settings not in the app config get the
+    defaults of config.Config
 '''
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    for key, value in vars(Config()).items():
+        app.config.setdefault(key, value)
+    if database_path is not None:
+        app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
     db.app = app
     db.init_app(app)
     db.create_all()
 
+'''
+on_question_change(app, listener)
+    registers listener(action, question) on the application,
+    it is called after a question change is committed with the action
+    ('insert', 'update', 'delete', or 'reload' when many rows changed
+    at once) and the formatted question (None on 'reload')
+'''
+def on_question_change(app, listener):
+    app.extensions.setdefault('question_listeners', []).append(listener)
+    return listener
+
+def notify_question_change(action, question=None):
+    for listener in db.get_app().extensions.get('question_listeners', []):
+        listener(action, question)
+
+'''
+content_hash(question, answer)
+    sha256 hex digest of the question and answer with the unicode forms,
+    case and spacing normalized and the final '.', '?' or '!' dropped,
+    so resubmitted questions that only differ by those get the same
+    hash. other symbols are kept: 'What is 2+2?' and 'What is 2*2?'
+    are different questions
+'''
+def content_hash(question, answer):
+    texts = []
+    for value in (question, answer):
+        value = unicodedata.normalize('NFKC', value or '').casefold()
+        value = re.sub(r'\s+', ' ', value).strip()
+        texts.append(value.rstrip('.?! '))
+    return hashlib.sha256('\n'.join(texts).encode('utf-8')).hexdigest()
+
+def _content_hash_default(context):
+    parameters = context.get_current_parameters()
+    return content_hash(parameters.get('question'), parameters.get('answer'))
+
 '''
 Question
 
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # (category, id) serves the category listing and quiz queries
+  # (filter on category, order by id), see migrations.py
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_difficulty', 'difficulty'),
+    # one question per content, see content_hash and migrations.py
+    Index('ix_questions_content_hash', 'content_hash', unique=True),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id'))
   difficulty = Column(Integer)
+  # set on insert from the question and answer, also by Core inserts
+  content_hash = Column(String(64), default=_content_hash_default)
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
@@ -43,14 +97,23 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
-    db.session.commit()
+    # flush to get the id before the commit expires the attributes
+    db.session.flush()
+    question = self.format()
+    commit_question_write()
+    notify_question_change('insert', question)
   
   def update(self):
-    db.session.commit()
+    self.content_hash = content_hash(self.question, self.answer)
+    question = self.format()
+    commit_question_write()
+    notify_question_change('update', question)
 
   def delete(self):
+    question = self.format()
     db.session.delete(self)
-    db.session.commit()
+    commit_question_write()
+    notify_question_change('delete', question)
 
   def format(self):
     return {
@@ -79,15 +142,244 @@ class Category(db.Model):
       'id': self.id,
       'type': self.type
     }
+
+'''
+QuestionBankVersion
+    one row table of the version of the question bank, shared by every
+    process: bump_bank_version increments it after each question write,
+    the ETags are built from it (see http_cache.py).
+    create_all inserts the row with the table.
+    PostgreSQL keeps the version in the bank_version_seq sequence
+    instead: nextval takes no row lock, the writers do not wait for
+    each other
+'''
+class QuestionBankVersion(db.Model):
+  __tablename__ = 'bank_version'
+
+  id = Column(Integer, primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+
+event.listen(QuestionBankVersion.__table__, 'after_create',
+             DDL('INSERT INTO bank_version (id, version) VALUES (1, 0)'))
+
+# created by create_all on PostgreSQL only
+bank_version_sequence = Sequence('bank_version_seq', metadata=db.metadata)
+
+'''
+_dialect(executor)
+return the dialect of executor (a session or a connection),
+    a connection knows its dialect, the session writes to the primary
+'''
+def _dialect(executor):
+    return getattr(executor, 'dialect', None) or db.engine.dialect
+
+'''
+bump_bank_version(executor)
+    increments the bank version on executor (a session or a connection).
+    call it after the question write is committed, in a transaction of
+    its own: a process that reads the new version then reads the new
+    questions too, and the writers do not hold the version while they
+    write. a reader between the commit and the bump gets the new
+    questions with the old version until the bump
+'''
+def bump_bank_version(executor):
+    if _dialect(executor).name == 'postgresql':
+        executor.execute(select([bank_version_sequence.next_value()]))
+        return
+    table = QuestionBankVersion.__table__
+    executor.execute(table.update().where(table.c.id == 1).values(
+        version=table.c.version + 1))
+
+'''
+read_bank_version(executor)
+return the bank version, 0 before the first write
+'''
+def read_bank_version(executor):
+    if _dialect(executor).name == 'postgresql':
+        row = executor.execute(text(
+            'SELECT last_value, is_called FROM bank_version_seq')).first()
+        return row.last_value if row.is_called else 0
+    table = QuestionBankVersion.__table__
+    return executor.execute(select([table.c.version]).where(
+        table.c.id == 1)).scalar() or 0
+
+'''
+commit_question_write()
+    commits the question write of the session,
+    then bumps the bank version in a transaction of its own
+'''
+def commit_question_write():
+    db.session.commit()
+    bump_bank_version(db.session)
+    db.session.commit()
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+'''
+parse_fields
+    the question columns asked by a fields= parameter ("id,question"),
+    id is always one of them
+return None (every column) when value is empty
+raise ValueError for a field that is not a question column
+'''
+def parse_fields(value):
+    if not value:
+        return None
+    fields = ['id']
+    for field in value.split(','):
+        field = field.strip()
+        if field not in QUESTION_FIELDS:
+            raise ValueError('unknown field {!r}'.format(field))
+        if field not in fields:
+            fields.append(field)
+    return tuple(fields)
+
+'''
+format_questions
+    runs the selection and formats its rows,
+    with fields only these columns are selected from the database
+'''
+def format_questions(selection, fields=None):
+    if fields is None:
+        return [question.format() for question in selection]
+    rows = selection.with_entities(
+        *[getattr(Question, field) for field in fields])
+    return [dict(zip(fields, row)) for row in rows]
+
+'''
+questions_by_ids
+    fetches the questions of a list of ids in one query,
+    fields (see parse_fields) limits the selected columns
+return formatted questions in the order of the ids,
+    ids not found are skipped
+'''
+def questions_by_ids(question_ids, fields=None):
+    if not question_ids:
+        return []
+    questions = format_questions(
+        Question.query.filter(Question.id.in_(question_ids)), fields)
+    by_id = {question['id']: question for question in questions}
+    return [by_id[question_id] for question_id in question_ids
+            if question_id in by_id]
+
+'''
+insert_question(executor, values)
+    inserts a question with one INSERT on executor (a session or
+    a connection), the caller commits, bumps the bank version
+    and notifies
+return the formatted question
+'''
+def insert_question(executor, values):
+    result = executor.execute(Question.__table__.insert().values(**values))
+    question = {field: values.get(field) for field in QUESTION_FIELDS}
+    question['id'] = result.inserted_primary_key[0]
+    return question
+
+'''
+find_duplicate(executor, values)
+    the question with the content hash of the question and answer of
+    values on executor (a session or a connection), one lookup of the
+    unique content_hash index
+return its id or None
+'''
+def find_duplicate(executor, values):
+    table = Question.__table__
+    return executor.execute(select([table.c.id]).where(
+        table.c.content_hash == content_hash(
+            values.get('question'), values.get('answer'))).limit(1)).scalar()
+
 '''
-paginate_questions 
+delete_question_rows(executor, question_ids)
+    deletes the questions of question_ids on executor (a session or
+    a connection): one DELETE ... RETURNING on PostgreSQL, a SELECT of
+    the rows and one DELETE on the other databases. the caller
+    commits, bumps the bank version and notifies
+return the formatted deleted questions, ids not found are skipped
 '''
-def paginate_questions(request, questions, questions_number):
-    page = request.args.get('page', 1, type=int)
-    start =  (page - 1) * questions_number
-    end = start + questions_number
+def delete_question_rows(executor, question_ids):
+    if not question_ids:
+        return []
+    table = Question.__table__
+    columns = [table.c[field] for field in QUESTION_FIELDS]
+    statement = table.delete().where(table.c.id.in_(question_ids))
+    if _dialect(executor).name == 'postgresql':
+        rows = executor.execute(statement.returning(*columns)).fetchall()
+    else:
+        rows = executor.execute(table.select().with_only_columns(
+            columns).where(table.c.id.in_(question_ids))).fetchall()
+        executor.execute(statement)
+    return sorted((dict(zip(QUESTION_FIELDS, row)) for row in rows),
+                  key=lambda question: question['id'])
+
+'''
+delete_questions(question_ids)
+    deletes the questions of question_ids in one transaction
+    and notifies the question listeners
+return the formatted deleted questions, ids not found are skipped
+'''
+def delete_questions(question_ids):
+    questions = delete_question_rows(db.session, question_ids)
+    if questions:
+        commit_question_write()
+    else:
+        db.session.commit()
+    for question in questions:
+        notify_question_change('delete', question)
+    return questions
+
+'''
+DatabaseSource
+    where the in-memory indexes and caches read the question bank from,
+    the database by default (snapshot.SnapshotSource in snapshot mode)
+'''
+class DatabaseSource:
+
+    def question_ids(self, category=None, after=None):
+        '''
+        return the ids of the questions of category (None for all)
+            in id order, only those above after when given
+        '''
+        query = db.session.query(Question.id)
+        if category is not None:
+            query = query.filter_by(category=category)
+        if after is not None:
+            query = query.filter(Question.id > after)
+        return (row.id for row in query.order_by(Question.id).yield_per(
+            10000))
+
+    def question_id_stats(self, category=None):
+        '''
+        return (count, max id) of the questions of category (None for all),
+            one query on the (category, id) index
+        '''
+        query = db.session.query(func.count(Question.id),
+                                 func.max(Question.id))
+        if category is not None:
+            query = query.filter_by(category=category)
+        count, max_id = query.one()
+        return count, max_id
+
+    def question_texts(self):
+        '''
+        return rows with the id and question of every question
+        '''
+        return db.session.query(Question.id, Question.question).yield_per(
+            1000)
+
+    def questions_by_ids(self, question_ids, fields=None):
+        return questions_by_ids(question_ids, fields)
+
+    def categories(self):
+        '''
+        return {id: type} of the categories
+        '''
+        return {category.id: category.type
+                for category in Category.query.order_by(Category.id)}
 
-    questions  = [question.format() for question in questions]
-    current_questions  = questions [start:end]
+    def bank_version(self):
+        '''
+        return the bank version, see QuestionBankVersion
+        '''
+        return read_bank_version(db.session)
 
-    return current_questions 
\ No newline at end of file
+database_source = DatabaseSource()
@@ -0,0 +1,266 @@
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from flask import g, request, has_app_context
+from sqlalchemy import event
+
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                    0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+# distinct stacks kept for one slow request
+MAX_SAMPLED_STACKS = 20
+
+
+'''
+Histogram
+    Prometheus histogram with one series per endpoint label
+'''
+class Histogram:
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for endpoint, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                        self.name, endpoint, bound, count))
+                lines.append('{}_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+                    self.name, endpoint, series['count']))
+                lines.append('{}_sum{{endpoint="{}"}} {}'.format(
+                    self.name, endpoint, series['sum']))
+                lines.append('{}_count{{endpoint="{}"}} {}'.format(
+                    self.name, endpoint, series['count']))
+        return lines
+
+
+'''
+LabeledCounter
+    Prometheus counter with one series per set of label values
+'''
+class LabeledCounter:
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] += amount
+
+    def value(self, *values):
+        return self._values[values]
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                labels = ','.join('{}="{}"'.format(label, value)
+                                  for label, value in zip(self.labels, values))
+                lines.append('{}{{{}}} {}'.format(self.name, labels, count))
+        return lines
+
+
+'''
+Metrics
+    histograms of the requests of one application, and the counters
+    other modules add with counter()
+'''
+class Metrics:
+
+    def __init__(self):
+        self.duration = Histogram(
+            'trivia_request_duration_seconds',
+            'Wall time of the requests.', DURATION_BUCKETS)
+        self.sql_queries = Histogram(
+            'trivia_request_sql_queries',
+            'SQL statements issued by the requests.', QUERY_COUNT_BUCKETS)
+        self.sql_duration = Histogram(
+            'trivia_request_sql_duration_seconds',
+            'Time spent in SQL statements by the requests.',
+            DURATION_BUCKETS)
+        self.serialization = Histogram(
+            'trivia_request_serialization_seconds',
+            'Time spent serializing the JSON responses.', DURATION_BUCKETS)
+        self.counters = []
+
+    def observe(self, endpoint, profile, duration):
+        self.duration.observe(endpoint, duration)
+        self.sql_queries.observe(endpoint, profile['queries'])
+        self.sql_duration.observe(endpoint, profile['sql'])
+        self.serialization.observe(endpoint, profile['serialization'])
+
+    def counter(self, name, help, labels):
+        counter = LabeledCounter(name, help, labels)
+        self.counters.append(counter)
+        return counter
+
+    def expose(self):
+        lines = []
+        for histogram in (self.duration, self.sql_queries,
+                          self.sql_duration, self.serialization):
+            lines.extend(histogram.expose())
+        for counter in self.counters:
+            lines.extend(counter.expose())
+        return '\n'.join(lines) + '\n'
+
+
+'''
+SlowRequestSampler
+    sampling profiler for slow requests: a thread takes the stack of
+    every request running for more than threshold seconds each interval
+    seconds, the stacks of a request slower than threshold are logged
+    when it ends. faster requests are never sampled
+'''
+class SlowRequestSampler:
+
+    def __init__(self, logger, threshold, interval=0.005):
+        self.logger = logger
+        self.threshold = threshold
+        self.interval = interval
+        self._requests = {}
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._run, daemon=True,
+                                  name='slow-request-sampler')
+        thread.start()
+
+    def start(self):
+        with self._lock:
+            self._requests[threading.get_ident()] = (time.perf_counter(),
+                                                     Counter())
+
+    def stop(self, description, duration):
+        with self._lock:
+            _, stacks = self._requests.pop(threading.get_ident(),
+                                           (None, Counter()))
+        if duration < self.threshold or not stacks:
+            return
+        dump = ['slow request {} {:.1f}ms, {} samples'.format(
+            description, duration * 1000, sum(stacks.values()))]
+        for stack, count in stacks.most_common(5):
+            dump.append('--- {} samples:\n{}'.format(count, stack))
+        self.logger.warning('\n'.join(dump))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, (start, stacks) in self._requests.items():
+                    frame = frames.get(ident)
+                    if frame is None or now - start < self.threshold:
+                        continue
+                    stack = ''.join(traceback.format_stack(frame))
+                    if stack in stacks or len(stacks) < MAX_SAMPLED_STACKS:
+                        stacks[stack] += 1
+
+
+def _profile():
+    if has_app_context():
+        return g.get('profile')
+    return None
+
+
+'''
+instrument_engine(engine)
+    counts the SQL statements of engine and their time in the profile
+    of the current request
+'''
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault('profile_query_start', []).append(
+            time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters,
+                             context, executemany):
+        start = conn.info['profile_query_start'].pop()
+        profile = _profile()
+        if profile is not None:
+            profile['queries'] += 1
+            profile['sql'] += time.perf_counter() - start
+
+
+'''
+add_serialization_time(seconds)
+    adds time spent serializing a response to the profile
+    of the current request
+'''
+def add_serialization_time(seconds):
+    profile = _profile()
+    if profile is not None:
+        profile['serialization'] += seconds
+
+
+'''
+init_profiling(app, engine)
+    records the wall time, SQL statements, SQL time and serialization
+    time of every request, sends them in a Server-Timing header and
+    keeps them as histograms for the /metrics route.
+    PROFILE_SLOW_REQUEST_MS in app config turns on the slow request sampler
+'''
+def init_profiling(app, engine):
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+    instrument_engine(engine)
+    sampler = None
+    threshold = app.config.get('PROFILE_SLOW_REQUEST_MS')
+    if threshold:
+        sampler = SlowRequestSampler(
+            app.logger, threshold / 1000.0,
+            app.config.get('PROFILE_SAMPLE_INTERVAL_MS', 5) / 1000.0)
+
+    @app.before_request
+    def start_profile():
+        g.profile = {'start': time.perf_counter(), 'queries': 0,
+                     'sql': 0.0, 'serialization': 0.0}
+        if sampler is not None:
+            sampler.start()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.get('profile')
+        if profile is None:
+            return response
+        duration = time.perf_counter() - profile['start']
+        response.headers['Server-Timing'] = (
+            'app;dur={:.2f}, db;dur={:.2f};desc="{} queries", '
+            'serialize;dur={:.2f}'.format(
+                duration * 1000, profile['sql'] * 1000, profile['queries'],
+                profile['serialization'] * 1000))
+        metrics.observe(request.endpoint or 'unknown', profile, duration)
+        if sampler is not None:
+            sampler.stop('{} {}'.format(request.method, request.full_path),
+                         duration)
+        return response
+
+    return metrics
@@ -0,0 +1,236 @@
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from models import database_source
+
+
+# key of the ids of every category
+ALL_CATEGORIES = None
+# questions.id is a PostgreSQL integer (int4)
+ID_TYPECODE = 'i'
+
+
+'''
+QuestionIdIndex
+    process-local sorted arrays of question ids, one per category and
+    one for all categories (key ALL_CATEGORIES), loaded the first time a
+    category is used and kept up to date by on_question_change.
+    at most max_ids ids are kept, the least recently used categories
+    are evicted first; a category bigger than max_ids is not kept.
+    the ids are read from source (models.DatabaseSource by default).
+    a category used ttl seconds after it was checked is compared with
+    the count and max id of the source: when only ids above its max id
+    were added they are appended, otherwise it is loaded again, so
+    changes committed by another process are seen after ttl seconds at
+    most. ttl None never checks: the source changes only with a 'reload'.
+    the queries run outside the lock: the requests go on with the ids
+    they have while one request checks a category, and a check that
+    raced with a change of this process is thrown away
+'''
+class QuestionIdIndex:
+
+    def __init__(self, max_ids=1000000, source=database_source, ttl=None):
+        self.max_ids = max_ids
+        self.source = source
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # category: time.monotonic() of the last check against source
+        self._checked_at = {}
+        # categories being checked by a request
+        self._checking = set()
+        # bumped by on_question_change
+        self._version = 0
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def ids(self, category=ALL_CATEGORIES):
+        '''
+        return the sorted array of the question ids of category,
+            do not change it
+        '''
+        with self._lock:
+            ids = self._entries.get(category)
+            if ids is not None:
+                self._entries.move_to_end(category)
+                if not self._check_due(category):
+                    return ids
+                self._checking.add(category)
+                known = (len(ids), ids[-1] if ids else None)
+            version = self._version
+        if ids is None:
+            added, loaded = None, self._load(category)
+        else:
+            try:
+                added, loaded = self._check(category, *known)
+            except BaseException:
+                with self._lock:
+                    self._checking.discard(category)
+                raise
+        with self._lock:
+            self._checking.discard(category)
+            if version != self._version or \
+                    self._entries.get(category) is not ids:
+                # changed meanwhile, the next use checks again
+                return loaded if loaded is not None else ids
+            if added is not None:
+                ids.extend(added)
+                self._size += len(added)
+            elif loaded is not None:
+                if ids is not None:
+                    del self._entries[category]
+                    self._size -= len(ids)
+                ids = loaded
+                if len(ids) > self.max_ids:
+                    return ids
+                self._entries[category] = ids
+                self._size += len(ids)
+            self._checked_at[category] = time.monotonic()
+            self._evict()
+            return ids
+
+    def total(self, category=ALL_CATEGORIES):
+        return len(self.ids(category))
+
+    def page(self, category, start, limit):
+        '''
+        return the ids of one page from position start
+        '''
+        ids = self.ids(category)
+        with self._lock:
+            return ids[start:start + limit].tolist()
+
+    def page_after(self, category, after, limit):
+        '''
+        return the ids of one page after the id after,
+            True if there are more ids after the page
+        '''
+        ids = self.ids(category)
+        with self._lock:
+            start = bisect_right(ids, after)
+            return ids[start:start + limit].tolist(), \
+                start + limit < len(ids)
+
+    def random_ids(self, category=ALL_CATEGORIES, count=1, exclude=()):
+        '''
+        pick up to count distinct random ids of category
+            that are not in exclude
+        return the ids and the number of ids that were not excluded
+        '''
+        ids = self.ids(category)
+        with self._lock:
+            positions = sorted(set(
+                position for position in (
+                    _position(ids, question_id) for question_id in exclude)
+                if position is not None))
+            remaining = len(ids) - len(positions)
+            picked = []
+            for position in random.sample(range(remaining),
+                                          min(count, remaining)):
+                # the n-th id that is not excluded
+                for excluded in positions:
+                    if excluded > position:
+                        break
+                    position += 1
+                picked.append(ids[position])
+            return picked, remaining
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            self._version += 1
+            if action == 'reload':
+                self._entries.clear()
+                self._checked_at.clear()
+                self._size = 0
+                return
+            question_id = question['id']
+            for category, ids in self._entries.items():
+                if action == 'delete' or (
+                        category not in (ALL_CATEGORIES,
+                                         question.get('category'))):
+                    self._size -= _remove(ids, question_id)
+                else:
+                    self._size += _insert(ids, question_id)
+            self._evict()
+
+    def _check_due(self, category):
+        return self.ttl is not None and category not in self._checking \
+            and time.monotonic() - self._checked_at.get(category, 0) \
+            >= self.ttl
+
+    def _check(self, category, count, max_id):
+        '''
+        compare the count and max id of the ids of category with source
+        return (None, None) when they are the same, (the ids above max_id,
+            None) when only those were added, (None, every id) otherwise
+        '''
+        source_count, source_max_id = \
+            self.source.question_id_stats(category)
+        if (source_count, source_max_id) == (count, max_id):
+            return None, None
+        if max_id is not None and source_max_id is not None and \
+                source_max_id > max_id:
+            added = array(ID_TYPECODE, self.source.question_ids(
+                category, after=max_id))
+            if count + len(added) == source_count:
+                return added, None
+        return None, self._load(category)
+
+    def _load(self, category):
+        return array(ID_TYPECODE, self.source.question_ids(category))
+
+    def _evict(self):
+        while self._size > self.max_ids and self._entries:
+            category, ids = self._entries.popitem(last=False)
+            self._checked_at.pop(category, None)
+            self._size -= len(ids)
+
+
+def _position(ids, question_id):
+    position = bisect_left(ids, question_id)
+    if position < len(ids) and ids[position] == question_id:
+        return position
+    return None
+
+
+def _insert(ids, question_id):
+    position = bisect_left(ids, question_id)
+    if position < len(ids) and ids[position] == question_id:
+        return 0
+    ids.insert(position, question_id)
+    return 1
+
+
+def _remove(ids, question_id):
+    position = _position(ids, question_id)
+    if position is None:
+        return 0
+    del ids[position]
+    return 1
+
+
+'''
+paginate_ids(request, index, category, questions_number, fields, load)
+    paginate_questions for the ids of a QuestionIdIndex category:
+    the page ids and the total come from the index, only the rows
+    of the page are fetched, by load(ids, fields) (the questions_by_ids
+    of the source of the index by default)
+return current questions, total questions, next cursor
+'''
+def paginate_ids(request, index, category, questions_number, fields=None,
+                 load=None):
+    load = load or index.source.questions_by_ids
+    total_questions = index.total(category)
+    after = request.args.get('after', None, type=int)
+    if after is None:
+        page = request.args.get('page', 1, type=int)
+        start = max(page - 1, 0) * questions_number
+        return load(index.page(category, start, questions_number),
+                    fields), total_questions, None
+
+    page_ids, more = index.page_after(category, after, questions_number)
+    questions = load(page_ids, fields)
+    next_cursor = page_ids[-1] if more and page_ids else None
+    return questions, total_questions, next_cursor
@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from question_index import ID_TYPECODE
+
+
+# sessions kept by InMemoryQuizSessionStore
+MAX_SESSIONS = 1000
+
+
+'''
+QuizSession
+    one quiz in progress: a pre-shuffled deck of question ids
+    that is popped from the end, so every next question is O(1).
+    the deck is an array of C ints, 4 bytes a question
+'''
+class QuizSession:
+
+    def __init__(self, category_id, question_ids, ttl):
+        self.id = uuid.uuid4().hex
+        self.category_id = category_id
+        self.deck = array(ID_TYPECODE, question_ids)
+        random.shuffle(self.deck)
+        self.total = len(self.deck)
+        self.ttl = ttl
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + self.ttl
+
+    def expired(self, now=None):
+        return (now or time.monotonic()) >= self.expires_at
+
+    def next_id(self):
+        '''
+        return the next question id of the deck or None when it is empty
+        '''
+        if not self.deck:
+            return None
+        return self.deck.pop()
+
+    def remaining(self):
+        return len(self.deck)
+
+
+'''
+QuizSessionStore
+    interface of the quiz session stores,
+    subclass it to keep the sessions somewhere else
+'''
+class QuizSessionStore:
+
+    def save(self, session):
+        raise NotImplementedError
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+'''
+InMemoryQuizSessionStore
+    keeps the sessions in a dict of the worker process in the order
+    of their last use, expired sessions are dropped on access and swept
+    on save. at most max_sessions are kept, saving one more drops the
+    least recently used session
+'''
+class InMemoryQuizSessionStore(QuizSessionStore):
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, session):
+        with self._lock:
+            self._sweep()
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[session.id] = session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.expired():
+                del self._sessions[session_id]
+                return None
+            session.touch()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _sweep(self):
+        # in the order of their last use with the same ttl, the sessions
+        # after one that has not expired have not expired either
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if not session.expired(now):
+                break
+            del self._sessions[session_id]
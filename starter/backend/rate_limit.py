@@ -0,0 +1,313 @@
+import math
+import sqlite3
+import threading
+import time
+from flask import g, request
+from encoding import jsonify
+
+
+# seconds a shed request is told to wait before it retries
+SHED_RETRY_AFTER = 1
+# buckets kept by InMemoryRateLimitStore before the full ones are dropped
+MAX_BUCKETS = 100000
+
+
+'''
+parse_limit(value)
+    rate limit of a "rate/burst" string: tokens per second and bucket
+    size, e.g. "5/10" for 5 requests a second with bursts of 10.
+    (rate, burst) tuples are returned as they are
+return (rate, burst) or None for no limit
+raise ValueError if the limit is not valid
+'''
+def parse_limit(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        rate, _, burst = value.partition('/')
+        value = (float(rate), float(burst or rate))
+    rate, burst = float(value[0]), float(value[1])
+    if rate <= 0 or burst < 1:
+        raise ValueError('rate limit {!r} is not valid'.format(value))
+    return rate, burst
+
+
+'''
+parse_route_limits(value)
+    route limits of a "endpoint=rate/burst,..." string,
+    e.g. "searchQuestion=2/5,quizPlay=5/10". dicts are parsed by value
+return {endpoint: (rate, burst)}
+raise ValueError if a limit is not valid
+'''
+def parse_route_limits(value):
+    if not value:
+        return {}
+    if isinstance(value, str):
+        items = []
+        for item in value.split(','):
+            endpoint, _, limit = item.strip().partition('=')
+            if not endpoint or not limit:
+                raise ValueError('route limit {!r} is not valid'.format(item))
+            items.append((endpoint.strip(), limit))
+        value = dict(items)
+    return {endpoint: parse_limit(limit) for endpoint, limit in value.items()}
+
+
+'''
+take_token(tokens, updated, now, rate, burst)
+    token bucket: the bucket had tokens at updated and gains rate tokens
+    a second up to burst, a request takes one token
+return (allowed, tokens, retry_after) with the tokens left at now and
+    the seconds before a token is available when not allowed
+'''
+def take_token(tokens, updated, now, rate, burst):
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+'''
+RateLimitStore
+    interface of the token bucket stores,
+    subclass it to keep the buckets somewhere else
+'''
+class RateLimitStore:
+
+    def take(self, key, rate, burst):
+        '''
+        take a token from the bucket of key
+        return (allowed, retry_after seconds)
+        '''
+        raise NotImplementedError
+
+
+'''
+InMemoryRateLimitStore
+    keeps the buckets in a dict of the worker process, so every worker
+    has its own limits. past max_buckets the buckets that are full
+    again are dropped: they are the same as a new bucket
+'''
+class InMemoryRateLimitStore(RateLimitStore):
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        # key: (tokens, updated, rate, burst)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))[:2]
+            allowed, tokens, retry_after = take_token(
+                tokens, updated, now, rate, burst)
+            if key not in self._buckets and \
+                    len(self._buckets) >= self.max_buckets:
+                self._sweep(now)
+            self._buckets[key] = (tokens, now, rate, burst)
+        return allowed, retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _sweep(self, now):
+        for key in [key for key, (tokens, updated, rate, burst)
+                    in self._buckets.items()
+                    if tokens + (now - updated) * rate >= burst]:
+            del self._buckets[key]
+
+
+'''
+SQLiteRateLimitStore
+    keeps the buckets in a SQLite file, so the workers of one host share
+    their limits. local stand-in for a shared store such as Redis: each
+    take is one IMMEDIATE transaction, which serializes the workers
+'''
+class SQLiteRateLimitStore(RateLimitStore):
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+            'updated REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst):
+        # wall clock, the monotonic clocks of the workers are not shared
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated FROM rate_limit_buckets '
+                'WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            allowed, tokens, retry_after = take_token(
+                tokens, updated, now, rate, burst)
+            connection.execute(
+                'INSERT OR REPLACE INTO rate_limit_buckets '
+                '(key, tokens, updated) VALUES (?, ?, ?)',
+                (key, tokens, now))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+
+'''
+create_rate_limit_store(url)
+    store of RATE_LIMIT_STORE: None or 'memory' for the in-process store,
+    'sqlite:///path/to/file.db' for a store shared by the workers
+raise ValueError for other urls
+'''
+def create_rate_limit_store(url=None):
+    if not url or url == 'memory':
+        return InMemoryRateLimitStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteRateLimitStore(url[len('sqlite:///'):])
+    raise ValueError('unknown rate limit store {!r}'.format(url))
+
+
+'''
+ConcurrencyLimiter
+    at most limit requests in progress, acquire() does not wait and
+    returns False when the limit is reached
+'''
+class ConcurrencyLimiter:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+'''
+client_id(header, trusted_hops)
+    the client of the request: with a header (e.g. X-Forwarded-For) the
+    address added by the trusted_hops-th proxy from the right, the proxies
+    append to the header and the client controls what is left of it.
+    the remote address without header
+'''
+def client_id(header=None, trusted_hops=1):
+    if header:
+        value = request.headers.get(header)
+        if value:
+            addresses = [address.strip() for address in value.split(',')]
+            return addresses[-min(max(trusted_hops, 1), len(addresses))]
+    return request.remote_addr or 'unknown'
+
+
+'''
+RateLimited
+    a request rejected with status (429 or 503), the client may
+    retry after retry_after seconds
+'''
+class RateLimited(Exception):
+
+    def __init__(self, status, retry_after):
+        Exception.__init__(self, status)
+        self.status = status
+        self.retry_after = retry_after
+
+
+'''
+init_rate_limits(app, metrics)
+    admission control before the views run, so a rejected request never
+    takes a database connection:
+    - MAX_CONCURRENT_REQUESTS requests in progress at most, the others
+      get 503 at once
+    - RATE_LIMIT_PER_CLIENT token bucket of each client over all routes
+      and RATE_LIMIT_ROUTES buckets of each client by endpoint, requests
+      without a token get 429
+    both set Retry-After. the buckets are in app.extensions['rate_limits'],
+    replace it to plug another RateLimitStore. rejections are counted in
+    the trivia_requests_rejected_total counter of metrics
+return the store or None when nothing is limited
+'''
+def init_rate_limits(app, metrics):
+    client_limit = parse_limit(app.config.get('RATE_LIMIT_PER_CLIENT'))
+    route_limits = parse_route_limits(app.config.get('RATE_LIMIT_ROUTES'))
+    max_concurrent = app.config.get('MAX_CONCURRENT_REQUESTS')
+    if client_limit is None and not route_limits and not max_concurrent:
+        return None
+    store = create_rate_limit_store(app.config.get('RATE_LIMIT_STORE'))
+    app.extensions['rate_limits'] = store
+    limiter = None
+    if max_concurrent:
+        limiter = ConcurrencyLimiter(max_concurrent)
+        app.extensions['concurrency_limiter'] = limiter
+    header = app.config.get('RATE_LIMIT_CLIENT_HEADER')
+    trusted_hops = app.config.get('RATE_LIMIT_TRUSTED_HOPS', 1)
+    rejected = metrics.counter(
+        'trivia_requests_rejected_total',
+        'Requests rejected by the admission control.',
+        ('endpoint', 'reason'))
+
+    def reject(status, reason, retry_after):
+        rejected.inc(request.endpoint or 'unknown', reason)
+        raise RateLimited(status, retry_after)
+
+    @app.before_request
+    def admit():
+        endpoint = request.endpoint or 'unknown'
+        if limiter is not None:
+            if not limiter.acquire():
+                reject(503, 'concurrency', SHED_RETRY_AFTER)
+            g.admitted = True
+        store = app.extensions['rate_limits']
+        client = client_id(header, trusted_hops)
+        if client_limit is not None:
+            allowed, retry_after = store.take(client, *client_limit)
+            if not allowed:
+                reject(429, 'client', retry_after)
+        route_limit = route_limits.get(endpoint)
+        if route_limit is not None:
+            allowed, retry_after = store.take(
+                '{} {}'.format(client, endpoint), *route_limit)
+            if not allowed:
+                reject(429, 'route', retry_after)
+
+    @app.teardown_request
+    def release(error=None):
+        if g.pop('admitted', False):
+            limiter.release()
+
+    @app.errorhandler(RateLimited)
+    def rate_limited(error):
+        messages = {429: 'too many requests', 503: 'service unavailable'}
+        response = jsonify({
+            "success": False,
+            "error": error.status,
+            "message": messages[error.status]
+        })
+        response.status_code = error.status
+        response.headers['Retry-After'] = str(
+            max(1, int(math.ceil(error.retry_after))))
+        return response
+
+    return store
@@ -0,0 +1,111 @@
+import itertools
+import threading
+import time
+from flask import request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm
+from sqlalchemy.sql.expression import TextClause, UpdateBase
+
+
+# cookie that sends the reads of a client to the primary after it wrote
+PRIMARY_COOKIE = 'db_primary_until'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+'''
+ReplicaRouter
+    read replica engines, next() returns them round-robin
+'''
+class ReplicaRouter:
+
+    def __init__(self, engines):
+        self.engines = engines
+        self._cycle = itertools.cycle(engines)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+'''
+RoutingSession
+    session of db: the statements go to the replica engine of
+    session.info['replica'] (set by init_replicas for the read requests).
+    flushes, INSERT/UPDATE/DELETE and text statements go to the primary,
+    and once the session wrote every later statement does too
+'''
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is None or self.info.get('wrote'):
+            return SignallingSession.get_bind(self, mapper, clause)
+        if self._flushing or isinstance(clause, (UpdateBase, TextClause)):
+            self.info['wrote'] = True
+            return SignallingSession.get_bind(self, mapper, clause)
+        return replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+'''
+read_only
+    decorator for the non-GET routes that only read, e.g. POST searches,
+    to send them to the replicas too
+'''
+def read_only(f):
+    f.read_only = True
+    return f
+
+
+'''
+init_replicas(app, db, engine_options)
+    creates an engine for each url of DATABASE_REPLICA_URLS and routes
+    the sessions of the read requests (GET, HEAD, OPTIONS and read_only
+    routes) to them round-robin. a request that writes sets a cookie
+    that sends the requests of the client to the primary for
+    DB_READ_YOUR_WRITES_SECONDS so it reads its writes despite the
+    replication lag.
+    engine_options(config) gives the create_engine options of a url
+return the ReplicaRouter or None without replicas
+'''
+def init_replicas(app, db, engine_options):
+    urls = app.config.get('DATABASE_REPLICA_URLS') or []
+    if not urls:
+        return None
+    engines = []
+    for url in urls:
+        config = dict(app.config, SQLALCHEMY_DATABASE_URI=url)
+        engines.append(create_engine(url, **engine_options(config)))
+    router = ReplicaRouter(engines)
+    app.extensions['replicas'] = router
+    window = app.config['DB_READ_YOUR_WRITES_SECONDS']
+
+    def is_read():
+        if request.method in READ_METHODS:
+            return True
+        view = app.view_functions.get(request.endpoint)
+        return getattr(view, 'read_only', False)
+
+    @app.before_request
+    def route_reads():
+        if not is_read():
+            return
+        pinned_until = request.cookies.get(PRIMARY_COOKIE, 0, type=float)
+        if pinned_until > time.time():
+            return
+        db.session.info['replica'] = router.next()
+
+    @app.after_request
+    def pin_writer(response):
+        if not is_read() and response.status_code < 400 and window > 0:
+            response.set_cookie(PRIMARY_COOKIE, str(time.time() + window),
+                                max_age=window, httponly=True)
+        return response
+
+    return router
@@ -0,0 +1,230 @@
+import heapq
+import re
+import threading
+import time
+from sqlalchemy import func, select
+from models import db, Question, database_source
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+TS_CONFIG = 'english'
+
+
+'''
+tokenize
+    lower case words of a text
+'''
+def tokenize(text):
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+'''
+SearchBackend
+    interface of the question search backends.
+    search returns one page of ranked question ids and the total
+    number of matches, on_question_change keeps the backend up to date
+'''
+class SearchBackend:
+
+    def search(self, term, offset, limit):
+        raise NotImplementedError
+
+    def on_question_change(self, action, question):
+        pass
+
+
+'''
+search_postgres(executor, term, offset, limit)
+    full-text search of term on executor (a session or a connection),
+    served by the GIN index on the tsvector of the question
+return one page of the matching question ids ranked with ts_rank,
+    and the total number of matches
+'''
+def search_postgres(executor, term, offset, limit):
+    table = Question.__table__
+    # the expression must match the index expression to use the index
+    document = func.to_tsvector(TS_CONFIG,
+                                func.coalesce(table.c.question, ''))
+    query = func.plainto_tsquery(TS_CONFIG, term)
+    matches = document.op('@@')(query)
+    total = executor.execute(select([func.count(table.c.id)]).where(
+        matches)).scalar()
+    rows = executor.execute(select([table.c.id]).where(matches).order_by(
+        func.ts_rank(document, query).desc(), table.c.id).offset(
+            offset).limit(limit))
+    return [row.id for row in rows], total
+
+
+'''
+PostgresSearchBackend
+    full-text search with a GIN index on the tsvector of the question
+    (built by migration 4, see migrations.py), results are ranked
+    with ts_rank
+'''
+class PostgresSearchBackend(SearchBackend):
+
+    def search(self, term, offset, limit):
+        return search_postgres(db.session, term, offset, limit)
+
+
+'''
+InvertedIndexSearchBackend
+    in-process inverted index token -> {question id: term count},
+    loaded lazily from source (the database by default) and updated
+    on question changes.
+    a question matches when it has every token of the search term,
+    the rank is the number of times the tokens appear in it.
+    used ttl seconds after its last check, the index compares the bank
+    version of source with the one it was loaded at and is loaded again,
+    outside the lock, when it changed. ttl None never checks
+'''
+class InvertedIndexSearchBackend(SearchBackend):
+
+    def __init__(self, source=database_source, ttl=None):
+        self.source = source
+        self.ttl = ttl
+        self._postings = {}
+        self._documents = {}
+        self._loaded = False
+        self._bank_version = None
+        self._checked_at = 0
+        # a request is checking the bank version
+        self._checking = False
+        # bumped by on_question_change
+        self._changes = 0
+        self._lock = threading.RLock()
+
+    def search(self, term, offset, limit):
+        tokens = set(tokenize(term))
+        if not tokens:
+            return [], 0
+        self._check()
+        with self._lock:
+            self._load()
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return [], 0
+            # intersect from the rarest token
+            postings.sort(key=len)
+            matches = set(postings[0])
+            for posting in postings[1:]:
+                matches.intersection_update(posting)
+            scores = [(-sum(posting[question_id] for posting in postings),
+                       question_id) for question_id in matches]
+        ranked = heapq.nsmallest(offset + limit, scores)
+        return [question_id for _, question_id in ranked[offset:]], \
+            len(scores)
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            self._changes += 1
+            if action == 'reload':
+                self._postings = {}
+                self._documents = {}
+                self._loaded = False
+            elif self._loaded:
+                self._remove(question['id'])
+                if action != 'delete':
+                    self._add(question['id'], question['question'])
+
+    def load(self, rows):
+        '''
+        index rows with the id and question of every question
+        instead of the question texts of source
+        '''
+        with self._lock:
+            self._set(None, *_index(rows))
+
+    def _check(self):
+        '''
+        load the index again when the bank version of source changed
+        since it was loaded, at most every ttl seconds
+        '''
+        with self._lock:
+            if not self._loaded or self.ttl is None or self._checking or \
+                    time.monotonic() - self._checked_at < self.ttl:
+                return
+            self._checking = True
+            changes = self._changes
+        try:
+            bank_version = self.source.bank_version()
+            loaded = None
+            if bank_version != self._bank_version:
+                loaded = _index(self.source.question_texts())
+        finally:
+            with self._lock:
+                self._checking = False
+        with self._lock:
+            if changes != self._changes:
+                # changed meanwhile, the next use checks again
+                return
+            if loaded is not None:
+                self._set(bank_version, *loaded)
+            self._checked_at = time.monotonic()
+
+    def _load(self):
+        if not self._loaded:
+            # read before the questions: a write meanwhile loads again
+            bank_version = self.source.bank_version()
+            self._set(bank_version, *_index(self.source.question_texts()))
+
+    def _set(self, bank_version, postings, documents):
+        self._postings = postings
+        self._documents = documents
+        self._loaded = True
+        self._bank_version = bank_version
+        self._checked_at = time.monotonic()
+
+    def _add(self, question_id, text):
+        _add(self._postings, self._documents, question_id, text)
+
+    def _remove(self, question_id):
+        for token in self._documents.pop(question_id, ()):
+            posting = self._postings[token]
+            del posting[question_id]
+            if not posting:
+                del self._postings[token]
+
+
+'''
+_index(rows)
+    index rows with the id and question of questions
+return the postings and the tokens of every question
+'''
+def _index(rows):
+    postings = {}
+    documents = {}
+    for row in rows:
+        _add(postings, documents, row.id, row.question)
+    return postings, documents
+
+
+def _add(postings, documents, question_id, text):
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    for token, count in counts.items():
+        postings.setdefault(token, {})[question_id] = count
+    documents[question_id] = tuple(counts)
+
+
+'''
+create_search_backend(name, source, ttl)
+    name is 'postgres' or 'inverted',
+    None picks postgres on a PostgreSQL database and inverted otherwise,
+    inverted always when source is not the database.
+    ttl is the ttl of the inverted index
+'''
+def create_search_backend(name=None, source=database_source, ttl=None):
+    if name is None:
+        name = 'postgres' if db.engine.dialect.name == 'postgresql' and \
+            source is database_source else 'inverted'
+    if name == 'postgres':
+        backend = PostgresSearchBackend()
+    elif name == 'inverted':
+        backend = InvertedIndexSearchBackend(source, ttl)
+    else:
+        raise ValueError('unknown search backend {!r}'.format(name))
+    return backend
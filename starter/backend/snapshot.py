@@ -0,0 +1,157 @@
+import signal
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from models import db, Question, Category, QUESTION_FIELDS, \
+    notify_question_change, read_bank_version
+
+
+QuestionText = namedtuple('QuestionText', ['id', 'question'])
+# category code of the questions without category
+NO_CATEGORY = 0
+
+
+'''
+QuestionSnapshot
+    read-only copy of the question bank in columns: arrays of the ids
+    (sorted), category ids and difficulties, lists of the question and answer
+    strings (interned, so repeated texts are stored once), the
+    categories {id: type} and the bank version they were read at.
+    the n-th question is at position n of every column
+'''
+class QuestionSnapshot:
+
+    def __init__(self, rows, categories, bank_version=0):
+        self.ids = array('i')
+        self.category_codes = array('i')
+        self.difficulties = array('i')
+        self.questions = []
+        self.answers = []
+        for row in rows:
+            self.ids.append(row.id)
+            self.category_codes.append(
+                NO_CATEGORY if row.category is None else row.category)
+            self.difficulties.append(row.difficulty or 0)
+            self.questions.append(sys.intern(row.question or ''))
+            self.answers.append(sys.intern(row.answer or ''))
+        self.categories = categories
+        self.bank_version = bank_version
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(cls):
+        '''
+        read every question and category in one transaction
+        return QuestionSnapshot
+        '''
+        try:
+            bank_version = read_bank_version(db.session)
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer,
+                Question.category, Question.difficulty).order_by(
+                    Question.id).yield_per(10000)
+            categories = {category.id: category.type for category
+                          in Category.query.order_by(Category.id)}
+            return cls(rows, categories, bank_version)
+        finally:
+            db.session.rollback()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def question(self, position, fields=QUESTION_FIELDS):
+        code = self.category_codes[position]
+        question = {
+            'id': self.ids[position],
+            'question': self.questions[position],
+            'answer': self.answers[position],
+            'category': None if code == NO_CATEGORY else code,
+            'difficulty': self.difficulties[position]
+        }
+        return {field: question[field] for field in fields}
+
+    def position(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+        return None
+
+
+'''
+SnapshotSource
+    models.DatabaseSource of the current QuestionSnapshot, for the indexes
+    and caches of the snapshot mode: they never query the database.
+    reload() loads a new snapshot, replaces the current one at once
+    and notifies a 'reload' so the indexes are rebuilt from it
+'''
+class SnapshotSource:
+
+    def __init__(self):
+        self.snapshot = QuestionSnapshot.load()
+        self._reload_lock = threading.Lock()
+
+    def reload(self):
+        '''
+        return the new QuestionSnapshot
+        '''
+        with self._reload_lock:
+            snapshot = QuestionSnapshot.load()
+            self.snapshot = snapshot
+            notify_question_change('reload')
+            return snapshot
+
+    def question_ids(self, category=None, after=None):
+        snapshot = self.snapshot
+        start = 0 if after is None else bisect_right(snapshot.ids, after)
+        if category is None:
+            return iter(snapshot.ids[start:])
+        return (question_id for question_id, code
+                in zip(snapshot.ids[start:], snapshot.category_codes[start:])
+                if code == category)
+
+    def question_texts(self):
+        snapshot = self.snapshot
+        return (QuestionText(question_id, question) for question_id, question
+                in zip(snapshot.ids, snapshot.questions))
+
+    def questions_by_ids(self, question_ids, fields=None):
+        snapshot = self.snapshot
+        questions = []
+        for question_id in question_ids:
+            position = snapshot.position(question_id)
+            if position is not None:
+                questions.append(snapshot.question(
+                    position, fields or QUESTION_FIELDS))
+        return questions
+
+    def categories(self):
+        return dict(self.snapshot.categories)
+
+    def bank_version(self):
+        return self.snapshot.bank_version
+
+
+'''
+install_reload_signal(app, source)
+    reloads the snapshot of source on SIGHUP, in a thread with an
+    application context. does nothing where there is no SIGHUP or
+    when not called from the main thread
+'''
+def install_reload_signal(app, source):
+    if not hasattr(signal, 'SIGHUP') or \
+            threading.current_thread() is not threading.main_thread():
+        return False
+
+    def reload():
+        with app.app_context():
+            snapshot = source.reload()
+        app.logger.info('snapshot reloaded, %d questions', len(snapshot))
+
+    def handler(signum, frame):
+        threading.Thread(target=reload, name='snapshot-reload').start()
+
+    signal.signal(signal.SIGHUP, handler)
+    return True
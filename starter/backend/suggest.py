@@ -0,0 +1,191 @@
+import heapq
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from models import database_source
+from search import TOKEN_PATTERN, tokenize
+
+
+# prefixes of at most this many characters keep their best words,
+# they match too many words to rank them on every keystroke
+SHORT_PREFIX_LENGTH = 2
+# words kept for each short prefix, the most a request can ask for
+SHORT_PREFIX_TOP = 50
+
+
+'''
+SuggestIndex
+    process-local typeahead index of the words of the questions:
+    a sorted array of the words for the prefix lookups and the number
+    of questions of each word for the ranking, the best words of the
+    short prefixes are kept once ranked. loaded from source on first
+    use, kept up to date by on_question_change with the text of the
+    inserted and deleted questions ('update' does not carry the old
+    text, the index is loaded again).
+    at most max_tokens words are kept: the most frequent ones when it is
+    loaded; once a word was left out no new word is added until the
+    next load, so the count of every kept word stays exact.
+    used ttl seconds after its last check, the index compares the bank
+    version of source with the one it was loaded at and is loaded again
+    when it changed, so the writes of other processes are seen after ttl
+    seconds at most. the load runs outside the lock, the requests go on
+    with the words they have meanwhile. ttl None never checks
+'''
+class SuggestIndex:
+
+    def __init__(self, max_tokens=100000, source=database_source,
+                 ttl=None):
+        self.max_tokens = max_tokens
+        self.source = source
+        self.ttl = ttl
+        self._clear()
+        # a request is checking the bank version
+        self._checking = False
+        # bumped by on_question_change
+        self._changes = 0
+        self._lock = threading.RLock()
+
+    def suggest(self, prefix, limit=10):
+        '''
+        return up to limit words starting with prefix,
+            the words of the most questions first
+        '''
+        prefix = prefix.lower()
+        self._check()
+        with self._lock:
+            self._load()
+            if len(prefix) <= SHORT_PREFIX_LENGTH and \
+                    limit <= SHORT_PREFIX_TOP:
+                top = self._top.get(prefix)
+                if top is None:
+                    top = self._top[prefix] = self._rank(
+                        prefix, SHORT_PREFIX_TOP)
+                return top[:limit]
+            return self._rank(prefix, limit)
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            self._changes += 1
+            if action in ('reload', 'update'):
+                self._clear()
+            elif self._loaded:
+                if action == 'delete':
+                    self._remove(question['question'])
+                else:
+                    self._add(question['question'])
+
+    def _clear(self):
+        self._tokens = []
+        self._counts = {}
+        self._top = {}
+        self._full = False
+        self._loaded = False
+        self._bank_version = None
+        self._checked_at = 0
+
+    def _rank(self, prefix, limit):
+        start = bisect_left(self._tokens, prefix)
+        end = bisect_left(self._tokens, prefix + '\uffff', start)
+        return heapq.nsmallest(
+            limit, self._tokens[start:end],
+            key=lambda token: (-self._counts[token], token))
+
+    def _check(self):
+        '''
+        load the index again when the bank version of source changed
+        since it was loaded, at most every ttl seconds
+        '''
+        with self._lock:
+            if not self._loaded or self.ttl is None or self._checking or \
+                    time.monotonic() - self._checked_at < self.ttl:
+                return
+            self._checking = True
+            changes = self._changes
+        try:
+            bank_version = self.source.bank_version()
+            loaded = None
+            if bank_version != self._bank_version:
+                loaded = self._read()
+        finally:
+            with self._lock:
+                self._checking = False
+        with self._lock:
+            if changes != self._changes:
+                # changed meanwhile, the next use checks again
+                return
+            if loaded is not None:
+                self._set(bank_version, *loaded)
+            self._checked_at = time.monotonic()
+
+    def _load(self):
+        if not self._loaded:
+            # read before the questions: a write meanwhile loads again
+            bank_version = self.source.bank_version()
+            self._set(bank_version, *self._read())
+
+    def _read(self):
+        '''
+        return the counts of the kept words of the questions of source,
+            True if words were left out
+        '''
+        counts = {}
+        for row in self.source.question_texts():
+            for token in set(tokenize(row.question)):
+                counts[token] = counts.get(token, 0) + 1
+        full = len(counts) > self.max_tokens
+        if full:
+            counts = {token: counts[token] for token in heapq.nlargest(
+                self.max_tokens, counts, key=counts.get)}
+        return {sys.intern(token): count
+                for token, count in counts.items()}, full
+
+    def _set(self, bank_version, counts, full):
+        self._counts = counts
+        self._full = full
+        self._tokens = sorted(counts)
+        self._top = {}
+        self._loaded = True
+        self._bank_version = bank_version
+        self._checked_at = time.monotonic()
+
+    def _add(self, text):
+        for token in set(tokenize(text)):
+            if token not in self._counts:
+                if self._full or len(self._counts) >= self.max_tokens:
+                    self._full = True
+                    continue
+                token = sys.intern(token)
+                self._counts[token] = 0
+                insort(self._tokens, token)
+            self._counts[token] += 1
+            self._forget_top(token)
+
+    def _remove(self, text):
+        for token in set(tokenize(text)):
+            if token not in self._counts:
+                continue
+            self._counts[token] -= 1
+            if not self._counts[token]:
+                del self._counts[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+            self._forget_top(token)
+
+    def _forget_top(self, token):
+        for length in range(1, SHORT_PREFIX_LENGTH + 1):
+            self._top.pop(token[:length], None)
+
+
+'''
+suggest_terms(index, term, limit)
+    completes the last word of term, the words before it are kept
+return the suggested terms
+'''
+def suggest_terms(index, term, limit=10):
+    words = tokenize(term)
+    if not words or not TOKEN_PATTERN.match(term[-1:]):
+        # nothing typed, or the last word is finished
+        return []
+    head = ' '.join(words[:-1])
+    return [(head + ' ' + token).strip()
+            for token in index.suggest(words[-1], limit)]
@@ -1,24 +1,37 @@
 import os
+import asyncio
+import gzip
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import tempfile
+import threading
+import shutil
+from sqlalchemy import create_engine, inspect
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import db, Question, Category, bump_bank_version, \
+    read_bank_version, database_source
+from config import Config, engine_options
+from migrations import upgrade, dedupe_questions
+from question_index import QuestionIdIndex, ALL_CATEGORIES
+from search import InvertedIndexSearchBackend
+from suggest import SuggestIndex
+from fragment_cache import QuestionFragmentCache
+from http_cache import BankVersion
+from quiz_sessions import QuizSession, InMemoryQuizSessionStore
+from encoding import get_encoder
+from asgi import create_asgi_app, asgi_request
+from rate_limit import SQLiteRateLimitStore
+from testing import TransactionalTestCase, create_test_app, database_url, \
+    session_app
 
 
-class TriviaTestCase(unittest.TestCase):
+class TriviaTestCase(TransactionalTestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.username = 'postgres'
-        self.password = '1'
-        self.database_path = "postgres://{}:{}@{}/{}".format(
-            self.username, self.password, 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        """Define test variables and use the app of the test session,
+        each test runs in a transaction rolled back by tearDown."""
+        TransactionalTestCase.setUp(self)
         self.new_question = {
             'question': 'What is the #1 search engine used today?',
             'answer': 'Google',
@@ -31,16 +44,6 @@ class TriviaTestCase(unittest.TestCase):
             'category': 1,
             'difficulty': 1
         }
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
 
     """
      test for each test for successful operation and for expected errors.
@@ -64,6 +67,45 @@ class TriviaTestCase(unittest.TestCase):
         # confirm the respones get 6 categories
         self.assertEqual(len(data['categories']), 6)
 
+    def test_get_categories_not_modified(self):
+        '''
+        Test get categories again with the ETag of the first response
+        return 304 without body
+        :pass
+        '''
+        res = self.client().get('/categories')
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers['ETag']
+        self.assertTrue(etag)
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+        # confirm the status response code is 304 is mean not modified
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_categories_cache_invalidate(self):
+        '''
+        Test the categories change after a new category is committed
+        :pass
+        '''
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+        with self.app.app_context():
+            category = Category(type='Music')
+            db.session.add(category)
+            db.session.commit()
+            try:
+                res = self.client().get('/categories',
+                                        headers={'If-None-Match': etag})
+                data = json.loads(res.data)
+                self.assertEqual(res.status_code, 200)
+                self.assertNotEqual(res.headers['ETag'], etag)
+                self.assertIn('Music', data['categories'].values())
+            finally:
+                db.session.delete(category)
+                db.session.commit()
+
     def test_get_paginate_questions(self):
         '''
         Test to get 10 questions
@@ -100,6 +142,219 @@ class TriviaTestCase(unittest.TestCase):
         # confirm response has element equal "message": "resource not found"
         self.assertEqual(data['message'], 'resource not found')
 
+    def test_get_questions_after_cursor(self):
+        '''
+        Test keyset pagination with ?after=<id>
+        return the next 10 questions and the cursor of the next page
+        :pass
+        '''
+        res = self.client().get('/questions?after=0')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        # confirm the cursor is the id of the last question of the page
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+        res = self.client().get(
+            '/questions?after={}'.format(data['next_cursor']))
+        next_data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        # confirm the next page starts after the cursor
+        self.assertGreater(next_data['questions'][0]['id'],
+                           data['next_cursor'])
+        self.assertEqual(next_data['totalQuestions'], data['totalQuestions'])
+
+    def test_get_questions_not_modified(self):
+        '''
+        Test get questions with the ETag of the first response
+        return 304 until a question is changed
+        :pass
+        '''
+        res = self.client().get('/questions?page=2')
+        etag = res.headers['ETag']
+        res = self.client().get('/questions?page=2',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        # confirm an other page has an other ETag
+        res = self.client().get('/questions?page=1',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.client().post('/questions', json=self.new_question)
+        res = self.client().get('/questions?page=2',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_bank_version_shared(self):
+        '''
+        Test the question writes bump the bank version in the database
+        and a change without notification (another process) is read
+        after ttl
+        :pass
+        '''
+        with self.app.app_context():
+            version = read_bank_version(db.session)
+        self.client().post('/questions', json=self.new_question)
+        with self.app.app_context():
+            self.assertEqual(read_bank_version(db.session), version + 1)
+            cached = BankVersion(database_source.bank_version, ttl=60)
+            checked = BankVersion(database_source.bank_version, ttl=0)
+            self.assertEqual(str(cached), str(version + 1))
+            str(checked)
+            bump_bank_version(db.session)
+            self.assertEqual(str(cached), str(version + 1))
+            self.assertEqual(str(checked), str(version + 2))
+            cached.bump()
+            self.assertEqual(str(cached), str(version + 2))
+
+    def test_server_timing_and_metrics(self):
+        '''
+        Test the requests send Server-Timing and are counted in /metrics
+        :pass
+        '''
+        res = self.client().get('/questions')
+        server_timing = res.headers['Server-Timing']
+        self.assertIn('app;dur=', server_timing)
+        self.assertIn('queries', server_timing)
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count'
+                      '{endpoint="getQuestions"} 1',
+                      res.data.decode('utf-8'))
+
+    def test_gzip_questions(self):
+        '''
+        Test the questions are compressed when the client accept gzip
+        and the ETag of the compressed response return 304
+        :pass
+        '''
+        res = self.client().get('/questions',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(res.data))
+        self.assertEqual(len(data['questions']), 10)
+        res = self.client().get('/questions', headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    def test_small_response_not_compressed(self):
+        '''
+        Test the responses under COMPRESS_MIN_SIZE are not compressed
+        :pass
+        '''
+        res = self.client().get('/categories',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(len(json.loads(res.data)['categories']), 6)
+
+    def test_get_questions_fields(self):
+        '''
+        Test get only some fields of the questions
+        :pass
+        '''
+        res = self.client().get('/questions?fields=question,category')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        # confirm the id is always sent
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'question', 'category'})
+        res = self.client().get('/categories/2/questions?fields=answer')
+        data = json.loads(res.data)
+        self.assertEqual(set(data['questions'][0]), {'id', 'answer'})
+
+    def test_error_get_questions_fields(self):
+        '''
+        Test get a field not exit in the questions
+        :pass
+        '''
+        res = self.client().get('/questions?fields=id,password')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_question_fragment_cache(self):
+        '''
+        Test the questions spliced from the fragment cache have the JSON
+        of the encoded questions, the cache counts hits and misses and
+        a deleted question is evicted
+        :pass
+        '''
+        counter = self.app.extensions['question_fragments'].counter
+        hits, misses = counter.value('hit'), counter.value('miss')
+        data = json.loads(self.client().get('/questions').data)
+        cached = json.loads(self.client().get('/questions').data)
+        fields = json.loads(self.client().get(
+            '/questions?fields=question,answer,category,difficulty').data)
+        self.assertEqual(data, cached)
+        self.assertEqual(data['questions'], fields['questions'])
+        self.assertEqual(counter.value('miss') - misses, 10)
+        self.assertEqual(counter.value('hit') - hits, 10)
+        question_id = data['questions'][0]['id']
+        evictions = counter.value('eviction')
+        res = self.client().delete('/questions/{}'.format(question_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(counter.value('eviction') - evictions, 1)
+        data = json.loads(self.client().get('/questions').data)
+        self.assertNotIn(question_id, [question['id']
+                                       for question in data['questions']])
+        metrics = self.client().get('/metrics').get_data(as_text=True)
+        self.assertIn('trivia_question_fragment_cache_total{result="hit"}',
+                      metrics)
+
+    def test_question_fragment_cache_size(self):
+        '''
+        Test the fragment cache keeps the most recently used questions
+        :pass
+        '''
+        with self.app.app_context():
+            cache = QuestionFragmentCache(2, get_encoder('json'))
+            fragments = cache.fragments([2, 4, 62334, 5])
+            self.assertEqual([fragment.id for fragment in fragments],
+                             [2, 4, 5])
+            self.assertEqual(json.loads(fragments[0])['answer'],
+                             'Apollo 13')
+            self.assertEqual(len(cache), 2)
+            cache.fragments([2])
+            self.assertEqual(list(cache._entries), [5, 2])
+
+    def test_question_fragment_cache_ttl(self):
+        '''
+        Test the fragment cache reads a question again after ttl,
+        so a change of another process is seen
+        :pass
+        '''
+        with self.app.app_context():
+            cached = QuestionFragmentCache(10, get_encoder('json'), ttl=60)
+            expired = QuestionFragmentCache(10, get_encoder('json'), ttl=0)
+            cached.fragments([2])
+            expired.fragments([2])
+            db.session.execute(Question.__table__.update().where(
+                Question.id == 2).values(answer='Apollo 14'))
+            self.assertEqual(json.loads(cached.fragments([2])[0])['answer'],
+                             'Apollo 13')
+            self.assertEqual(json.loads(expired.fragments([2])[0])['answer'],
+                             'Apollo 14')
+
+    def test_bootstrap(self):
+        '''
+        Test get categories and first page of questions in one request,
+        with the ETag of the question routes
+        :pass
+        '''
+        res = self.client().get('/bootstrap')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(self.client().get('/questions').data)
+        self.assertEqual(data['questions'], page['questions'])
+        self.assertEqual(data['totalQuestions'], page['totalQuestions'])
+        self.assertEqual(data['categories'], page['categories'])
+        self.assertTrue(data['version'])
+        res = self.client().get('/bootstrap', headers={
+            'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
     def test_sucsse_delete_question(self):
         '''
         Test the delete the question exit in db
@@ -134,6 +389,25 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], "unprocessable")
 
+    def test_bulk_delete_questions(self):
+        '''
+        Test delete many questions in one request
+        :pass
+        '''
+        for _ in range(3):
+            self.client().post('/questions', json=self.new_question)
+        with self.app.app_context():
+            ids = [question.id for question in Question.query.filter_by(
+                question=self.new_question['question'])]
+        res = self.client().delete('/questions',
+                                   json={'ids': ids + [62334]})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], sorted(ids))
+        self.assertEqual(data['not_found'], [62334])
+        res = self.client().delete('/questions', json={'ids': ['1']})
+        self.assertEqual(res.status_code, 400)
+
     def test_create_new_question(self):
         '''
         Test insert question with data in db
@@ -147,6 +421,53 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertIsNotNone(data['question'])
 
+    def test_409_if_question_exists(self):
+        '''
+        Test insert a question that differs from one in db
+        only by case, final punctuation and spaces
+        :pass
+        '''
+        res = self.client().post('/questions', json=self.new_question)
+        self.assertEqual(res.status_code, 200)
+        res = self.client().post('/questions', json=dict(
+            self.new_question, question='  what is the #1 SEARCH engine '
+            'used today', answer='google.'))
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'question already exists')
+        res = self.client().post('/questions', json=dict(
+            self.new_question, answer='Bing'))
+        self.assertEqual(res.status_code, 200)
+        # confirm symbols inside the text make other questions
+        for question in ('What is 2+2?', 'What is 2*2?', 'Is C++ C#?',
+                         'Is C++ C?'):
+            res = self.client().post('/questions', json=dict(
+                self.new_question, question=question, answer='4'))
+            self.assertEqual(res.status_code, 200)
+
+    def test_create_question_string_category(self):
+        '''
+        Test a category id sent as a string is stored as the integer id
+        :pass
+        '''
+        question = dict(self.new_question, category='2')
+        res = self.client().post('/questions', json=question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['category'], 2)
+
+    def test_422_if_question_creation_unknown_category(self):
+        '''
+        Test insert question of a category that does not exist
+        :pass
+        '''
+        question = dict(self.new_question, category=1000)
+        res = self.client().post('/questions', json=question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_404_if_questions_creation_no_data(self):
         '''
         Test insert question without data in db
@@ -161,6 +482,135 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unprocessable')
 
+    def test_bulk_create_questions_ndjson(self):
+        '''
+        Test insert questions from NDJSON in batches
+        the rows not valid are reported with their line
+        :pass
+        '''
+        lines = [json.dumps(dict(self.new_question, answer=answer))
+                 for answer in ('Google', 'Bing', 'DuckDuckGo')] + [
+            json.dumps(self.new_question_empty), 'not json']
+        res = self.client().post('/questions/bulk?batch_size=2',
+                                 data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 3)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [4, 5])
+
+    def test_bulk_create_questions_updates_indexes(self):
+        '''
+        Test the imported questions are added to the id index and the
+        search index one by one, the indexes are not rebuilt
+        :pass
+        '''
+        index = self.app.extensions['question_index']
+        with self.app.app_context():
+            total = len(index.ids())
+        lines = [json.dumps(dict(self.new_question, question=question))
+                 for question in ('Bulk qwertz one?', 'Bulk qwertz two?')]
+        res = self.client().post('/questions/bulk',
+                                 data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        self.assertEqual(json.loads(res.data)['inserted'], 2)
+        self.assertIn(ALL_CATEGORIES, index._entries)
+        self.assertEqual(len(index._entries[ALL_CATEGORIES]), total + 2)
+        data = json.loads(self.client().post(
+            '/questions/search', json={'searchTerm': 'qwertz'}).data)
+        self.assertEqual(sorted(question['question']
+                                for question in data['questions']),
+                         ['Bulk qwertz one?', 'Bulk qwertz two?'])
+
+    def test_bulk_create_questions_duplicates(self):
+        '''
+        Test rows with the content of a question of the bank
+        or of an earlier row are skipped as duplicates
+        :pass
+        '''
+        lines = [json.dumps(question) for question in (
+            self.new_question,
+            dict(self.new_question, question='what is the #1 search '
+                 'engine used today', answer='google'),
+            {'question': 'La Giaconda is better known as what?',
+             'answer': 'Mona Lisa', 'difficulty': 3, 'category': 2})]
+        res = self.client().post('/questions/bulk',
+                                 data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['duplicates'], 2)
+        self.assertEqual(data['errors'], [
+            {'line': 2, 'message': 'duplicate question'},
+            {'line': 3, 'message': 'duplicate question'}])
+
+    def test_bulk_create_questions_unknown_category(self):
+        '''
+        Test a row of a category that does not exist is reported
+        and the other rows of its batch are inserted
+        :pass
+        '''
+        lines = [json.dumps(self.new_question),
+                 json.dumps(dict(self.new_question, answer='Bing',
+                                 category=1000))]
+        res = self.client().post('/questions/bulk',
+                                 data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [
+            {'line': 2, 'message': 'category 1000 does not exist'}])
+
+    def test_bulk_create_questions_csv(self):
+        '''
+        Test insert questions from CSV
+        :pass
+        '''
+        body = ('question,answer,difficulty,category\n'
+                'What is the capital of Italy?,Rome,1,3\n'
+                '"Who wrote ""Hamlet""?",Shakespeare,2,4\n')
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['failed'], 0)
+
+    def test_error_bulk_create_questions_content_type(self):
+        '''
+        Test insert questions with a body not NDJSON or CSV
+        :pass
+        '''
+        res = self.client().post('/questions/bulk', json=[self.new_question])
+        self.assertEqual(res.status_code, 400)
+
+    def test_export_questions(self):
+        '''
+        Test download the questions of a category as NDJSON and CSV
+        :pass
+        '''
+        res = self.client().get('/questions/export?category=2')
+        self.assertEqual(res.status_code, 200)
+        rows = [json.loads(line) for line in res.data.splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(set(row['category'] for row in rows), {2})
+        res = self.client().get('/questions/export?format=csv&category=2')
+        self.assertEqual(res.status_code, 200)
+        lines = res.data.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'id,question,answer,difficulty,category')
+        self.assertEqual(len(lines), 5)
+
+    def test_error_export_questions_format(self):
+        '''
+        Test download the questions in a format not exit
+        :pass
+        '''
+        res = self.client().get('/questions/export?format=xml')
+        self.assertEqual(res.status_code, 400)
+
     def test_search_in_questions(self):
         '''
         Test search question with data in db
@@ -177,6 +627,219 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertIsNotNone(data['questions'])
 
+    def test_search_total_questions(self):
+        '''
+        Test search return the number of all matches
+        :pass
+        '''
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'soccer world cup'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['totalQuestions'], 2)
+        self.assertEqual(len(data['questions']), 2)
+
+    def test_search_new_question(self):
+        '''
+        Test search find a question created after the first search
+        :pass
+        '''
+        # first search load the index
+        self.client().post('/questions/search',
+                           json={'searchTerm': 'search engine'})
+        self.client().post('/questions', json=self.new_question)
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'search engine'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'][0]['question'],
+                         self.new_question['question'])
+
+    def test_category_total_follows_insert_and_delete(self):
+        '''
+        Test the question id index of a category is updated by
+        a new question and a deleted question
+        :pass
+        '''
+        url = '/categories/{}/questions'.format(self.new_question['category'])
+        total = json.loads(self.client().get(url).data)['totalQuestions']
+        res = self.client().post('/questions', json=self.new_question)
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(self.client().get(url).data)
+        self.assertEqual(data['totalQuestions'], total + 1)
+        question_id = max(question['id'] for question in data['questions'])
+        self.client().delete('/questions/{}'.format(question_id))
+        data = json.loads(self.client().get(url).data)
+        self.assertEqual(data['totalQuestions'], total)
+
+    def test_question_index_evicts_least_recently_used(self):
+        '''
+        Test the question id index keeps at most max_ids ids
+        :pass
+        '''
+        with self.app.app_context():
+            categories = [category for category, in db.session.query(
+                Question.category).distinct() if category is not None]
+            sizes = {category: len(QuestionIdIndex().ids(category))
+                     for category in categories}
+            first, second = sorted(categories, key=sizes.get)[-2:]
+            index = QuestionIdIndex(max_ids=sizes[second])
+            index.ids(first)
+            index.ids(second)
+            self.assertNotIn(first, index._entries)
+            self.assertIn(second, index._entries)
+            self.assertLessEqual(index._size, sizes[second])
+
+    def test_question_index_sees_other_process_changes(self):
+        '''
+        Test the question id index loads a category again after ttl
+        when a question was added without a notification
+        :pass
+        '''
+        with self.app.app_context():
+            cached = QuestionIdIndex(ttl=60)
+            checked = QuestionIdIndex(ttl=0)
+            total = len(cached.ids(1))
+            self.assertEqual(len(checked.ids(1)), total)
+            db.session.execute(Question.__table__.insert().values(
+                question='Other process?', answer='Yes', difficulty=1,
+                category=1))
+            self.assertEqual(len(cached.ids(1)), total)
+            ids = checked.ids(1)
+            # confirm the new id is appended to the same array
+            self.assertEqual(len(ids), total + 1)
+            self.assertIs(checked.ids(1), ids)
+            self.assertEqual(len(checked.ids(2)), len(cached.ids(2)))
+            db.session.execute(Question.__table__.delete().where(
+                Question.id == ids[0]))
+            self.assertEqual(checked.ids(1).tolist(), ids.tolist()[1:])
+
+    def test_question_index_checks_outside_lock(self):
+        '''
+        Test the other requests get the ids while one request
+        checks the category against the source
+        :pass
+        '''
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowSource:
+            def question_ids(self, category=None, after=None):
+                return [1, 2, 3]
+
+            def question_id_stats(self, category=None):
+                started.set()
+                release.wait(5)
+                return 3, 3
+
+        index = QuestionIdIndex(source=SlowSource(), ttl=0)
+        self.assertEqual(index.ids(1).tolist(), [1, 2, 3])
+        checker = threading.Thread(target=index.ids, args=(1,))
+        checker.start()
+        self.assertTrue(started.wait(5))
+        try:
+            self.assertEqual(index.page(1, 0, 2), [1, 2])
+        finally:
+            release.set()
+            checker.join()
+
+    def test_suggest(self):
+        '''
+        Test complete the last word of the query
+        :pass
+        '''
+        res = self.client().get('/questions/suggest?q=Who%20disc')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('who discovered', data['suggestions'])
+        data = json.loads(
+            self.client().get('/questions/suggest?q=who%20').data)
+        self.assertEqual(data['suggestions'], [])
+
+    def test_suggest_follows_insert_and_delete(self):
+        '''
+        Test the words of a new question are suggested until it is deleted
+        :pass
+        '''
+        url = '/questions/suggest?q=zyxw'
+        self.assertEqual(json.loads(
+            self.client().get(url).data)['suggestions'], [])
+        question = dict(self.new_question, question='Who is zyxwvut?')
+        self.client().post('/questions', json=question)
+        self.assertEqual(json.loads(
+            self.client().get(url).data)['suggestions'], ['zyxwvut'])
+        with self.app.app_context():
+            question_id = Question.query.filter_by(
+                question='Who is zyxwvut?').first().id
+        self.client().delete('/questions/{}'.format(question_id))
+        self.assertEqual(json.loads(
+            self.client().get(url).data)['suggestions'], [])
+
+    def test_suggest_index_max_tokens(self):
+        '''
+        Test the typeahead index keeps at most max_tokens words
+        :pass
+        '''
+        with self.app.app_context():
+            index = SuggestIndex(max_tokens=5)
+            index.suggest('a')
+            self.assertEqual(len(index._tokens), 5)
+            index.on_question_change('insert', {
+                'id': 10 ** 6, 'question': 'qwertyuiop'})
+            self.assertEqual(index.suggest('qwer'), [])
+
+    def test_suggest_short_prefix(self):
+        '''
+        Test the ranked words of a short prefix are kept
+        until a question with one of its words changes
+        :pass
+        '''
+        with self.app.app_context():
+            index = SuggestIndex()
+            top = index.suggest('w', 50)
+            self.assertEqual(index.suggest('w', 3), top[:3])
+            self.assertIn('w', index._top)
+            for question_id in (10 ** 6, 10 ** 6 + 1):
+                index.on_question_change('insert', {
+                    'id': question_id, 'question': 'wxyz wxyz?'})
+            self.assertNotIn('w', index._top)
+            self.assertEqual(index.suggest('wx'), ['wxyz'])
+            index.on_question_change('delete', {
+                'id': 10 ** 6, 'question': 'wxyz wxyz?'})
+            self.assertEqual(index._counts['wxyz'], 1)
+            index.on_question_change('delete', {
+                'id': 10 ** 6 + 1, 'question': 'wxyz wxyz?'})
+            self.assertEqual(index.suggest('wx'), [])
+            self.assertEqual(index.suggest('w', 50), top)
+
+    def test_search_indexes_see_other_process_changes(self):
+        '''
+        Test the typeahead and inverted search indexes are loaded again
+        after ttl when the bank version changed without a notification
+        :pass
+        '''
+        with self.app.app_context():
+            suggest = SuggestIndex(ttl=0)
+            search = InvertedIndexSearchBackend(ttl=0)
+            cached = InvertedIndexSearchBackend(ttl=60)
+            self.assertEqual(suggest.suggest('zyxw'), [])
+            self.assertEqual(search.search('zyxwv', 0, 10), ([], 0))
+            self.assertEqual(cached.search('zyxwv', 0, 10), ([], 0))
+            question_id = db.session.execute(
+                Question.__table__.insert().values(
+                    question='Zyxwv other process?', answer='Yes',
+                    difficulty=1, category=1)).inserted_primary_key[0]
+            bump_bank_version(db.session)
+            self.assertEqual(suggest.suggest('zyxw'), ['zyxwv'])
+            self.assertEqual(search.search('zyxwv', 0, 10),
+                             ([question_id], 1))
+            self.assertEqual(cached.search('zyxwv', 0, 10), ([], 0))
+            db.session.execute(Question.__table__.delete().where(
+                Question.id == question_id))
+            bump_bank_version(db.session)
+            self.assertEqual(suggest.suggest('zyxw'), [])
+            self.assertEqual(search.search('zyxwv', 0, 10), ([], 0))
+
     def test_search_in_questions_no_data(self):
         '''
         Test insert question without data in db
@@ -271,6 +934,139 @@ class TriviaTestCase(unittest.TestCase):
         self.assertNotEqual(data['question']['id'], 3)
         self.assertNotEqual(data['question']['id'], 12)
 
+    def test_get_quizzes_category_used_up(self):
+        '''
+        Test play quizzes when every question of the category was asked
+        return 'success': True and no question
+        :pass
+        '''
+        data_json = {
+            "previous_questions": [16, 17, 18, 19],
+            "quiz_category": {"type": "Art", "id": 2}
+        }
+        res = self.client().post('/quizzes', json=data_json)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIsNone(data['question'])
+        self.assertTrue(data['exhausted'])
+
+    def test_get_quizzes_count(self):
+        '''
+        Test ask for many quiz questions in one request
+        return the unseen questions of the category and exhausted
+        :pass
+        '''
+        data_json = {
+            "previous_questions": [16],
+            "quiz_category": {"type": "Art", "id": 2},
+            "count": 10
+        }
+        res = self.client().post('/quizzes', json=data_json)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(sorted(ids), [17, 18, 19])
+        self.assertEqual(data['question']['id'], ids[0])
+        self.assertTrue(data['exhausted'])
+        data_json['count'] = 2
+        data = json.loads(self.client().post('/quizzes', json=data_json).data)
+        self.assertEqual(len(set(q['id'] for q in data['questions'])), 2)
+        self.assertFalse(data['exhausted'])
+
+    def test_400_quizzes_count(self):
+        '''
+        Test ask for no quiz question
+        :pass
+        '''
+        res = self.client().post('/quizzes', json={
+            "previous_questions": [],
+            "quiz_category": {"type": "Art", "id": 2},
+            "count": 0
+        })
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_quizzes_bad_input(self):
+        '''
+        Test a quiz category without id or previous questions
+        that are not ids are bad requests
+        :pass
+        '''
+        for body in ({"previous_questions": [], "quiz_category": {}},
+                     {"previous_questions": ["x"],
+                      "quiz_category": {"type": "Art", "id": 2}},
+                     {"previous_questions": "5",
+                      "quiz_category": {"type": "Art", "id": 2}}):
+            res = self.client().post('/quizzes', json=body)
+            self.assertEqual(res.status_code, 400)
+
+    def test_get_quizzes_string_previous_questions(self):
+        '''
+        Test previous questions sent as strings are excluded
+        :pass
+        '''
+        ids = [question.id for question in
+               Question.query.filter(Question.category == 2)]
+        res = self.client().post('/quizzes', json={
+            "previous_questions": [str(question_id)
+                                   for question_id in ids[1:]],
+            "quiz_category": {"type": "Art", "id": "2"}
+        })
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], ids[0])
+        self.assertTrue(data['exhausted'])
+
+    def test_quiz_session(self):
+        '''
+        Test play a quiz session on category until the deck is empty
+        :pass
+        '''
+        res = self.client().post('/quizzes/sessions', json={
+            "quiz_category": {"type": "Art", "id": 2}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['session_id'])
+        url = '/quizzes/sessions/{}/next'.format(data['session_id'])
+        asked = set()
+        for _ in range(data['totalQuestions']):
+            question = json.loads(self.client().post(url).data)['question']
+            self.assertEqual(question['category'], 2)
+            asked.add(question['id'])
+        # confirm the questions are not repeated and the deck ends
+        self.assertEqual(len(asked), data['totalQuestions'])
+        data = json.loads(self.client().post(url).data)
+        self.assertIsNone(data['question'])
+        self.assertEqual(data['remaining'], 0)
+
+    def test_quiz_session_store_max_sessions(self):
+        '''
+        Test the session store keeps at most max_sessions sessions,
+        the least recently used one is dropped first
+        :pass
+        '''
+        store = InMemoryQuizSessionStore(max_sessions=2)
+        first, second, third = [QuizSession(2, [16, 17, 18], 60)
+                                for _ in range(3)]
+        store.save(first)
+        store.save(second)
+        self.assertIs(store.get(first.id), first)
+        store.save(third)
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get(second.id))
+        self.assertIs(store.get(first.id), first)
+        self.assertEqual(first.deck.typecode, 'i')
+
+    def test_error_quiz_session_not_found(self):
+        '''
+        Test next question of a session not exit
+        :pass
+        '''
+        res = self.client().post('/quizzes/sessions/notexit/next')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_error_quiz_category_not_found_quizzes(self):
         '''
         Test play quizzes on none (no data) category with data in db
@@ -288,6 +1084,489 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+class ConfigTestCase(unittest.TestCase):
+    """This class represents the configuration test case"""
+
+    def test_engine_options_postgres(self):
+        '''
+        Test the pool settings and statement timeout of PostgreSQL
+        :pass
+        '''
+        config = vars(Config())
+        config.update({'SQLALCHEMY_DATABASE_URI':
+                       'postgres://postgres@localhost:5432/trivia',
+                       'DB_POOL_SIZE': 20, 'DB_POOL_PRE_PING': True,
+                       'DB_STATEMENT_TIMEOUT_MS': 5000})
+        options = engine_options(config)
+        self.assertEqual(options['pool_size'], 20)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args']['options'],
+                         '-c statement_timeout=5000')
+
+    def test_engine_options_sqlite(self):
+        '''
+        Test SQLite get no pool settings
+        :pass
+        '''
+        config = vars(Config())
+        config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.assertEqual(engine_options(config), {})
+
+    def test_create_app_sqlite_memory(self):
+        '''
+        Test create the app on an in-memory SQLite database
+        :pass
+        '''
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+        res = app.test_client().get('/categories')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'], {})
+
+
+class GroupCommitTestCase(unittest.TestCase):
+    """This class represents the group commit test case, its writes
+    are committed by the group commit thread and cleaned up by the test"""
+
+    def test_group_commit(self):
+        '''
+        Test concurrent writes of the group commit mode share transactions
+        and each request gets its own result
+        :pass
+        '''
+        app = create_test_app({'GROUP_COMMIT_WINDOW_MS': 50})
+        committer = app.extensions['group_commit']
+        responses = []
+
+        def post(number):
+            responses.append(app.test_client().post('/questions', json={
+                'question': 'Group {}?'.format(number), 'answer': 'Yes',
+                'category': 5, 'difficulty': 2}))
+        threads = [threading.Thread(target=post, args=(number,))
+                   for number in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([res.status_code for res in responses], [200] * 5)
+        self.assertEqual(committer.writes, 5)
+        self.assertLess(committer.batches, 5)
+        res = app.test_client().delete('/questions/62334')
+        self.assertEqual(res.status_code, 422)
+        with app.app_context():
+            ids = [question.id for question
+                   in Question.query.filter(
+                       Question.question.like('Group %?'))]
+        self.assertEqual(len(ids), 5)
+        res = app.test_client().delete('/questions', json={'ids': ids})
+        self.assertEqual(json.loads(res.data)['deleted'], sorted(ids))
+
+
+class SnapshotTestCase(unittest.TestCase):
+    """This class represents the snapshot mode test case"""
+
+    def setUp(self):
+        self.app = create_test_app({'SNAPSHOT_MODE': True})
+        self.client = self.app.test_client
+
+    def assertNoQueries(self, res):
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('desc="0 queries"', res.headers['Server-Timing'])
+
+    def test_reads_without_database(self):
+        '''
+        Test the read routes are served by the snapshot
+        :pass
+        '''
+        self.assertNoQueries(self.client().get('/categories'))
+        self.assertNoQueries(self.client().get('/questions?page=2'))
+        self.assertNoQueries(self.client().get('/categories/2/questions'))
+        self.assertNoQueries(self.client().post(
+            '/questions/search', json={'searchTerm': 'title'}))
+        self.assertNoQueries(self.client().post('/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 0},
+            'count': 5}))
+
+    def test_writes_rejected(self):
+        '''
+        Test the writes get 405 in snapshot mode
+        :pass
+        '''
+        res = self.client().post('/questions', json={
+            'question': 'Q', 'answer': 'A', 'difficulty': 1, 'category': 1})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data['message'], 'method not allowed')
+        res = self.client().delete('/questions/1')
+        self.assertEqual(res.status_code, 405)
+
+    def test_reload(self):
+        '''
+        Test the snapshot sees the database changes after a reload
+        :pass
+        '''
+        url = '/categories/1/questions'
+        total = json.loads(self.client().get(url).data)['totalQuestions']
+        with self.app.app_context():
+            question = Question('Snapshot?', 'Yes', 1, 1)
+            db.session.add(question)
+            db.session.commit()
+            question_id = question.id
+        try:
+            data = json.loads(self.client().get(url).data)
+            self.assertEqual(data['totalQuestions'], total)
+            res = self.client().post('/snapshot/reload')
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(self.client().get(url).data)
+            self.assertEqual(data['totalQuestions'], total + 1)
+        finally:
+            with self.app.app_context():
+                db.session.delete(Question.query.get(question_id))
+                db.session.commit()
+
+    def test_reload_not_in_snapshot_mode(self):
+        '''
+        Test reload without snapshot mode
+        :pass
+        '''
+        res = create_test_app().test_client().post('/snapshot/reload')
+        self.assertEqual(res.status_code, 404)
+
+
+
+class AsgiTestCase(unittest.TestCase):
+    """This class represents the ASGI application test case"""
+
+    def setUp(self):
+        # seed the database first, session_app() would do it later
+        # under the app
+        session_app()
+        self.app = create_asgi_app(
+            {'SQLALCHEMY_DATABASE_URI': database_url()})
+
+    def tearDown(self):
+        asyncio.run(self.app.db.dispose())
+
+    def request(self, method, path, json_body=None):
+        return asyncio.run(asgi_request(self.app, method, path, json_body))
+
+    def test_get_questions(self):
+        '''
+        Test the questions and categories have the JSON of the Flask app
+        :pass
+        '''
+        status, data = self.request('GET', '/questions')
+        flask_data = json.loads(create_test_app().test_client().get(
+            '/questions').data)
+        self.assertEqual(status, 200)
+        self.assertEqual(data, flask_data)
+        status, data = self.request('GET', '/questions?page=1000')
+        self.assertEqual(status, 404)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_get_questions_on_category(self):
+        '''
+        Test the questions of a category and a category not exit
+        :pass
+        '''
+        status, data = self.request('GET', '/categories/2/questions')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['categories'], 'Art')
+        self.assertTrue(all(question['category'] == 2
+                            for question in data['questions']))
+        status, data = self.request('GET', '/categories/1000/questions')
+        self.assertEqual(status, 404)
+
+    def test_search_and_quizzes(self):
+        '''
+        Test search and quiz
+        :pass
+        '''
+        status, data = self.request('POST', '/questions/search',
+                                    {'searchTerm': 'title'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['totalQuestions'], len(data['questions']))
+        status, data = self.request('POST', '/questions/search',
+                                    {'searchTerm': ''})
+        self.assertEqual(status, 422)
+        flask_client = create_test_app().test_client()
+        for term in ('cup world', 'Tit', '%'):
+            status, data = self.request('POST', '/questions/search',
+                                        {'searchTerm': term})
+            res = flask_client.post('/questions/search',
+                                    json={'searchTerm': term})
+            self.assertEqual(status, res.status_code)
+            self.assertEqual(data, json.loads(res.data))
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': [16],
+            'quiz_category': {'type': 'Art', 'id': 2}, 'count': 10})
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(question['id']
+                                for question in data['questions']),
+                         [17, 18, 19])
+        self.assertTrue(data['exhausted'])
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': ['16', '18'],
+            'quiz_category': {'type': 'Art', 'id': 2}, 'count': 1})
+        self.assertEqual(status, 200)
+        self.assertIn(data['question']['id'], (17, 19))
+        self.assertFalse(data['exhausted'])
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': [], 'quiz_category': 0, 'count': 50})
+        self.assertEqual(status, 400)
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': [], 'quiz_category': {'id': 0},
+            'count': 50})
+        self.assertEqual(status, 200)
+        with create_test_app().app_context():
+            total = Question.query.count()
+        self.assertEqual(len(set(question['id']
+                                 for question in data['questions'])),
+                         min(50, total))
+        for quiz_category in (None, {}):
+            status, data = self.request('POST', '/quizzes', {
+                'previous_questions': [], 'quiz_category': quiz_category})
+            self.assertEqual(status, 400)
+
+    def test_create_and_delete_question(self):
+        '''
+        Test create and delete a question, delete a question not exit
+        and method not allowed
+        :pass
+        '''
+        status, data = self.request('POST', '/questions', {
+            'question': 'Asgi?', 'answer': 'Yes', 'difficulty': 1,
+            'category': '1'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['category'], 1)
+        with create_test_app().app_context():
+            question_id = Question.query.filter_by(
+                question='Asgi?').first().id
+        status, data = self.request(
+            'DELETE', '/questions/{}'.format(question_id))
+        self.assertEqual(status, 200)
+        status, data = self.request(
+            'DELETE', '/questions/{}'.format(question_id))
+        self.assertEqual(status, 422)
+        status, data = self.request('PUT', '/categories')
+        self.assertEqual(status, 405)
+
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        primary = os.path.join(self.workdir.name, 'primary.db')
+        replica = os.path.join(self.workdir.name, 'replica.db')
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + primary,
+            'DATABASE_REPLICA_URLS': ['sqlite:///' + replica],
+            # cached questions are served whatever database they came from
+            'QUESTION_FRAGMENT_CACHE_SIZE': 0})
+        with self.app.app_context():
+            db.session.add(Category(type='Science'))
+            db.session.commit()
+        # the replica is a copy of the primary taken before the writes
+        shutil.copyfile(primary, replica)
+
+    def tearDown(self):
+        for engine in self.app.extensions['replicas'].engines:
+            engine.dispose()
+        with self.app.app_context():
+            db.engine.dispose()
+        self.workdir.cleanup()
+
+    def test_read_your_writes(self):
+        '''
+        Test a client that wrote reads from the primary,
+        another client reads from the replica
+        :pass
+        '''
+        writer = self.app.test_client()
+        res = writer.post('/questions', json={
+            'question': 'Q', 'answer': 'A', 'difficulty': 1, 'category': 1})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('db_primary_until', res.headers['Set-Cookie'])
+        data = json.loads(writer.get('/categories/1/questions').data)
+        self.assertEqual(len(data['questions']), 1)
+        data = json.loads(
+            self.app.test_client().get('/categories/1/questions').data)
+        self.assertEqual(data['questions'], [])
+
+    def test_quiz_sessions_read_replica(self):
+        '''
+        Test quiz sessions only read: they do not pin the client
+        to the primary
+        :pass
+        '''
+        client = self.app.test_client()
+        res = client.post('/quizzes/sessions',
+                          json={'quiz_category': {'id': 0}})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Set-Cookie', res.headers)
+        session_id = json.loads(res.data)['session_id']
+        res = client.post('/quizzes/sessions/{}/next'.format(session_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Set-Cookie', res.headers)
+
+
+class MigrationTestCase(unittest.TestCase):
+    """This class represents the schema migrations test case"""
+
+    def test_upgrade_category_foreign_key(self):
+        '''
+        Test migration 1 turns a string category of the old schema
+        into the integer category id
+        :pass
+        '''
+        with tempfile.TemporaryDirectory() as workdir:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(workdir, 'old.db'))
+            engine.execute('CREATE TABLE categories '
+                           '(id INTEGER PRIMARY KEY, type VARCHAR)')
+            engine.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, '
+                           'question VARCHAR, answer VARCHAR, '
+                           'category VARCHAR, difficulty INTEGER)')
+            engine.execute("INSERT INTO categories VALUES (1, 'Science')")
+            engine.execute("INSERT INTO questions VALUES "
+                           "(1, 'q1', 'a1', '1', 2), (2, 'q2', 'a2', '9', 1), "
+                           "(3, 'q3', 'a3', '1', 3)")
+            self.assertEqual(upgrade(engine, batch_size=2), [1, 2, 3, 4, 5])
+            rows = engine.execute(
+                'SELECT id, category FROM questions ORDER BY id').fetchall()
+            self.assertEqual([tuple(row) for row in rows],
+                             [(1, 1), (2, None), (3, 1)])
+            indexes = [index['name']
+                       for index in inspect(engine).get_indexes('questions')]
+            self.assertIn('ix_questions_category_id', indexes)
+            self.assertEqual(upgrade(engine), [])
+            engine.dispose()
+
+    def test_upgrade_content_hash(self):
+        '''
+        Test migration 2 hashes the questions, reports the later copies
+        of a question without deleting them and adds the unique index,
+        dedupe_questions deletes them when asked
+        :pass
+        '''
+        with tempfile.TemporaryDirectory() as workdir:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(workdir, 'old.db'))
+            engine.execute('CREATE TABLE categories '
+                           '(id INTEGER PRIMARY KEY, type VARCHAR)')
+            engine.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, '
+                           'question VARCHAR, answer VARCHAR, '
+                           'category INTEGER, difficulty INTEGER)')
+            engine.execute("INSERT INTO questions VALUES "
+                           "(1, 'Q one?', 'A', 1, 2), (2, 'q  ONE', 'a', 1, 2), "
+                           "(3, 'Q two?', 'A', 1, 2), (4, 'Q one?', 'B', 1, 2), "
+                           "(5, 'Q two', 'a.', 1, 2)")
+            self.assertEqual(upgrade(engine, batch_size=2), [1, 2, 3, 4, 5])
+            rows = engine.execute('SELECT id FROM questions WHERE '
+                                  'content_hash IS NOT NULL ORDER BY id'
+                                  ).fetchall()
+            self.assertEqual([row[0] for row in rows], [1, 3, 4])
+            self.assertEqual(engine.execute(
+                'SELECT count(*) FROM questions').scalar(), 5)
+            indexes = {index['name']: index['unique']
+                       for index in inspect(engine).get_indexes('questions')}
+            self.assertTrue(indexes['ix_questions_content_hash'])
+            engine.execute("INSERT INTO questions (id, question, answer) "
+                           "VALUES (6, 'q three', 'a'), (7, 'Q THREE', 'A'),"
+                           " (8, 'What is 2+2?', '4'), (9, 'What is 2*2?', '4')")
+            self.assertEqual(dedupe_questions(engine),
+                             (3, [(2, 1), (5, 3), (7, 6)]))
+            self.assertEqual(dedupe_questions(engine, delete=True),
+                             (0, [(2, 1), (5, 3), (7, 6)]))
+            rows = engine.execute('SELECT id FROM questions ORDER BY id')
+            self.assertEqual([row[0] for row in rows], [1, 3, 4, 6, 8, 9])
+            engine.dispose()
+
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """This class represents the rate limits test case"""
+
+    def test_route_rate_limit(self):
+        '''
+        Test a client past the bucket of a route gets 429 with Retry-After,
+        other routes are not limited and the rejection is counted
+        :pass
+        '''
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                          'RATE_LIMIT_ROUTES': 'getAllCategories=0.1/2'})
+        client = app.test_client()
+        self.assertEqual(client.get('/categories').status_code, 200)
+        self.assertEqual(client.get('/categories').status_code, 200)
+        res = client.get('/categories')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['message'], 'too many requests')
+        self.assertTrue(1 <= int(res.headers['Retry-After']) <= 10)
+        res = client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        metrics = res.get_data(as_text=True)
+        self.assertIn('trivia_requests_rejected_total{'
+                      'endpoint="getAllCategories",reason="route"} 1',
+                      metrics)
+
+    def test_client_behind_proxy(self):
+        '''
+        Test the client is the address the trusted proxy added to
+        X-Forwarded-For, the addresses the client sent do not matter
+        :pass
+        '''
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                          'RATE_LIMIT_PER_CLIENT': '0.1/1',
+                          'RATE_LIMIT_CLIENT_HEADER': 'X-Forwarded-For'})
+        client = app.test_client()
+        res = client.get('/categories', headers={
+            'X-Forwarded-For': '1.1.1.1, 10.0.0.1'})
+        self.assertEqual(res.status_code, 200)
+        res = client.get('/categories', headers={
+            'X-Forwarded-For': '2.2.2.2, 10.0.0.1'})
+        self.assertEqual(res.status_code, 429)
+        res = client.get('/categories', headers={
+            'X-Forwarded-For': '10.0.0.2'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_concurrency_cap(self):
+        '''
+        Test requests past MAX_CONCURRENT_REQUESTS get 503 at once
+        :pass
+        '''
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                          'MAX_CONCURRENT_REQUESTS': 1})
+        limiter = app.extensions['concurrency_limiter']
+        client = app.test_client()
+        self.assertEqual(client.get('/categories').status_code, 200)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertTrue(limiter.acquire())
+        res = client.get('/categories')
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        limiter.release()
+        self.assertEqual(client.get('/categories').status_code, 200)
+
+    def test_sqlite_store_shared(self):
+        '''
+        Test two SQLite stores on one file share their buckets
+        :pass
+        '''
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'limits.db')
+            first = SQLiteRateLimitStore(path)
+            second = SQLiteRateLimitStore(path)
+            self.assertTrue(first.take('client', 0.01, 2)[0])
+            self.assertTrue(second.take('client', 0.01, 2)[0])
+            allowed, retry_after = first.take('client', 0.01, 2)
+            self.assertFalse(allowed)
+            self.assertGreater(retry_after, 0)
+            self.assertTrue(second.take('other', 0.01, 2)[0])
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
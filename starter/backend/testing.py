@@ -0,0 +1,185 @@
+import os
+import re
+import tempfile
+import unittest
+from flask import _app_ctx_stack
+from sqlalchemy import Integer, event, orm
+from flaskr import create_app
+from models import db, notify_question_change
+
+
+# database of the tests, {worker} is the pytest-xdist worker id so every
+# worker has its own database
+DEFAULT_TEST_DATABASE_URL = 'sqlite:///' + os.path.join(
+    tempfile.gettempdir(), 'trivia_test_{worker}.db')
+SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'trivia.psql')
+COPY_PATTERN = re.compile(r'^COPY (?:\w+\.)?(\w+) \(([^)]*)\) FROM stdin;$')
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+# application of the test session, see session_app()
+_app = None
+
+
+'''
+database_url()
+    TEST_DATABASE_URL, by default a SQLite file in the temporary directory,
+    with {worker} replaced by the pytest-xdist worker id ('main' without
+    xdist), e.g. postgres://postgres@localhost:5432/trivia_test_{worker}
+'''
+def database_url():
+    url = os.environ.get('TEST_DATABASE_URL') or DEFAULT_TEST_DATABASE_URL
+    return url.format(worker=os.environ.get('PYTEST_XDIST_WORKER', 'main'))
+
+
+'''
+read_copy_blocks(path)
+    the rows of the COPY ... FROM stdin blocks of a pg_dump file
+return list of (table, columns, rows) with the rows as lists of strings,
+    None for \\N
+'''
+def read_copy_blocks(path=SEED_FILE):
+    blocks = []
+    rows = None
+    with open(path, encoding='utf-8') as dump:
+        for line in dump:
+            line = line.rstrip('\n')
+            if rows is None:
+                match = COPY_PATTERN.match(line)
+                if match:
+                    rows = []
+                    columns = [column.strip()
+                               for column in match.group(2).split(',')]
+                    blocks.append((match.group(1), columns, rows))
+            elif line == '\\.':
+                rows = None
+            else:
+                rows.append([_copy_value(value) for value in line.split('\t')])
+    return blocks
+
+
+def _copy_value(value):
+    if value == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda match: COPY_ESCAPES.get(
+        match.group(1), match.group(1)), value)
+
+
+'''
+seed_database(connection, path)
+    inserts the rows of the COPY blocks of path into the tables of db,
+    and moves the PostgreSQL id sequences past them
+'''
+def seed_database(connection, path=SEED_FILE):
+    for table_name, columns, rows in read_copy_blocks(path):
+        table = db.metadata.tables[table_name]
+        integers = [isinstance(table.c[column].type, Integer)
+                    for column in columns]
+        connection.execute(table.insert(), [
+            {column: int(value) if integer and value is not None else value
+             for column, integer, value in zip(columns, integers, row)}
+            for row in rows])
+        if connection.dialect.name == 'postgresql' and 'id' in table.c:
+            connection.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "COALESCE(MAX(id), 1)) FROM {0}".format(table_name))
+
+
+'''
+use_sqlite_savepoints(engine)
+    pysqlite starts its transactions itself and lets SAVEPOINT break
+    them, emit BEGIN instead so nested transactions work. affects the
+    connections opened after the call
+'''
+def use_sqlite_savepoints(engine):
+    @event.listens_for(engine, 'connect')
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def do_begin(connection):
+        connection.execute('BEGIN')
+
+
+'''
+session_app()
+    application of the test session on database_url(), built once by
+    process: the tables are created again and seeded from trivia.psql
+return Flask application
+'''
+def session_app():
+    global _app
+    if _app is None:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': database_url()})
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                use_sqlite_savepoints(db.engine)
+                db.engine.dispose()
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as connection:
+                seed_database(connection)
+        _app = app
+    return _app
+
+
+'''
+create_test_app(config)
+    create_app on the seeded database of the test session,
+    for the tests that need their own settings
+'''
+def create_test_app(config=None):
+    session_app()
+    return create_app(dict(config or {},
+                           SQLALCHEMY_DATABASE_URI=database_url()))
+
+
+'''
+savepoint_session(connection)
+    scoped session of db on connection that runs in a SAVEPOINT: commits
+    and rollbacks of the views end the SAVEPOINT and start a new one,
+    the transaction of connection is never ended
+'''
+def savepoint_session(connection):
+    factory = db.create_session({'bind': connection, 'binds': {}})
+
+    @event.listens_for(factory, 'after_transaction_end')
+    def restart_savepoint(session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    def create_session():
+        session = factory()
+        session.begin_nested()
+        return session
+
+    return orm.scoped_session(create_session,
+                              scopefunc=_app_ctx_stack.__ident_func__)
+
+
+'''
+TransactionalTestCase
+    test case on the application of the test session: every test runs in
+    a transaction rolled back by tearDown, so the tests see the seeded
+    database and do not see each other's changes. tearDown notifies a
+    'reload' so the indexes and caches forget the rolled back changes
+'''
+class TransactionalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = session_app()
+        self.client = self.app.test_client
+        with self.app.app_context():
+            self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self._session = db.session
+        db.session = savepoint_session(self.connection)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.session = self._session
+            self.transaction.rollback()
+            self.connection.close()
+            notify_question_change('reload')
@@ -0,0 +1,14 @@
+import $ from 'jquery';
+
+// GET /bootstrap: categories, first page of questions and totals in one
+// request instead of one request each, for the question list. every mount
+// sends its own request (the ETag makes it cheap when nothing changed), so
+// a view opened after a change, e.g. back from /add, does not show the data
+// of an older one. the form and the quiz only need the categories, they
+// keep GET /categories
+export function getBootstrap() {
+  return $.ajax({
+    url: `/bootstrap`,
+    type: "GET"
+  })
+}
@@ -4,6 +4,7 @@ import '../stylesheets/App.css';
 import Question from './Question';
 import Search from './Search';
 import $ from 'jquery';
+import { getBootstrap } from '../bootstrap';
 
 class QuestionView extends Component {
   constructor(){
@@ -18,7 +19,16 @@ class QuestionView extends Component {
   }
 
   componentDidMount() {
-    this.getQuestions();
+    getBootstrap()
+      .done((result) => {
+        this.setState({
+          questions: result.questions,
+          totalQuestions: result.totalQuestions,
+          categories: result.categories })
+      })
+      .fail(() => {
+        alert('Unable to load questions. Please try your request again')
+      })
   }
 
   getQuestions = () => {
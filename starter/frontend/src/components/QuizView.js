@@ -15,6 +15,7 @@ class QuizView extends Component {
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
+        quizQuestions: [],
         guess: '',
         forceEnd: false
     }
@@ -36,38 +37,30 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.getQuizQuestions)
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+  getQuizQuestions = () => {
     $.ajax({
       url: '/quizzes', 
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        previous_questions: [],
+        quiz_category: this.state.quizCategory,
+        count: questionsPerPlay
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.setState({ quizQuestions: result.questions }, this.getNextQuestion)
         return;
       },
       error: (error) => {
@@ -77,6 +70,21 @@ class QuizView extends Component {
     })
   }
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions]
+    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+    const [nextQuestion, ...quizQuestions] = this.state.quizQuestions
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      currentQuestion: nextQuestion || {},
+      quizQuestions: quizQuestions,
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
@@ -94,6 +102,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      quizQuestions: [],
       guess: '',
       forceEnd: false
     })
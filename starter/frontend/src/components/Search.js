@@ -1,8 +1,13 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
+
+// wait for a pause in typing before asking for suggestions
+const suggestDelay = 150;
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   }
 
   getInfo = (event) => {
@@ -14,6 +19,28 @@ class Search extends Component {
     this.setState({
       query: this.search.value
     })
+    clearTimeout(this.suggestTimer)
+    this.suggestTimer = setTimeout(this.getSuggestions, suggestDelay)
+  }
+
+  getSuggestions = () => {
+    const query = this.state.query
+    $.ajax({
+      url: `/questions/suggest`,
+      type: "GET",
+      data: { q: query },
+      success: (result) => {
+        // a newer query was typed meanwhile
+        if (query === this.state.query) {
+          this.setState({ suggestions: result.suggestions })
+        }
+        return;
+      }
+    })
+  }
+
+  componentWillUnmount() {
+    clearTimeout(this.suggestTimer)
   }
 
   render() {
@@ -23,7 +50,13 @@ class Search extends Component {
           placeholder="Search questions..."
           ref={input => this.search = input}
           onChange={this.handleInputChange}
+          list="search-suggestions"
         />
+        <datalist id="search-suggestions">
+          {this.state.suggestions.map(suggestion => (
+            <option key={suggestion} value={suggestion} />
+          ))}
+        </datalist>
         <input type="submit" value="Submit" className="button"/>
       </form>
     )